@@ -3,68 +3,169 @@ from __future__ import absolute_import
 __all__ = ["Fit_data"]
 
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy import interpolate
 
-class Fit_data:
-    """A class for data."""
-    
-    def __init__(self, x, y, xtitle, ytitle, name, xunits, yunits, log):
-        self.xrange = [x.min(), x.max()]
-        self.yrange = [y.min(), y.max()]
+# interpolation backends, each builds a callable from sorted (x, y) arrays
+_backends = {'linear': lambda x, y: interpolate.make_interp_spline(x, y, k=1),
+             'cubic': lambda x, y: interpolate.make_interp_spline(x, y, k=3),
+             'pchip': interpolate.PchipInterpolator,
+             'akima': interpolate.Akima1DInterpolator}
+
+# Gauss-Legendre rule used to integrate log scaled data between its samples
+_nodes, _weights = np.polynomial.legendre.leggauss(8)
+
+class Fit_data(object):
+    """A class for data.
+
+    The interpolator is built on first use and kept on the instance; setting x, y,
+    log or kind discards it.  kind selects the interpolation backend: 'linear',
+    'cubic' (the default), 'pchip' or 'akima'.
+
+    Instances are callable (same as func) and provide integral, antiderivative
+    and derivative computed from the spline instead of with generic quadrature
+    or finite differences."""
+
+    __slots__ = ('_x', '_y', '_log', '_kind', '_interpolator', '_curve',
+                 'xtitle', 'ytitle', 'name', 'xunits', 'yunits')
     
-        self.x = x
-        self.y = y
+    def __init__(self, x, y, xtitle, ytitle, name, xunits, yunits, log, kind='cubic'):
+        self._interpolator = None
+        self._curve = None
+        self.x = np.asarray(x, dtype='f8')
+        self.y = np.asarray(y, dtype='f8')
         self.xtitle = xtitle
         self.ytitle = ytitle
         self.log = log
         self.name = name
         self.xunits = xunits
         self.yunits = yunits
-        
-    def func(self, x):
-        if self.log[0] == 1:
-            fit_x = np.log10(self.x)
-        else: fit_x = self.x
-        
-        if self.log[1] == 1:
-            fit_y = np.log10(self.y)
-            fill_value = -100
-        else: 
-            fit_y = self.y
-            fill_value = 0
-        
-        f = interpolate.interp1d(fit_x, fit_y, kind = 3, bounds_error=False, fill_value = fill_value)    
-        x_in = x
+        self.kind = kind
+
+    def _reset(name):
+        def fset(self, value):
+            setattr(self, '_' + name, value)
+            self._interpolator = None
+            self._curve = None
+        return property(lambda self: getattr(self, '_' + name), fset)
+
+    x = _reset('x')
+    y = _reset('y')
+    log = _reset('log')
+    kind = _reset('kind')
+    del _reset
+
+    @property
+    def xrange(self):
+        return [self.x.min(), self.x.max()]
+
+    @property
+    def yrange(self):
+        return [self.y.min(), self.y.max()]
+
+    def interpolator(self):
+        """Return the interpolator of y (log10 y if log[1]) against x (log10 x if log[0])"""
+        if self._interpolator is None:
+            if self.kind not in _backends:
+                raise ValueError("kind must be one of " + ", ".join(sorted(_backends)))
+
+            fit_x = np.log10(self.x) if self.log[0] == 1 else np.asarray(self.x, dtype='f8')
+            fit_y = np.log10(self.y) if self.log[1] == 1 else np.asarray(self.y, dtype='f8')
+            order = np.argsort(fit_x)
+            self._interpolator = _backends[self.kind](fit_x[order], fit_y[order])
+        return self._interpolator
+
+    def _fit_x(self, x):
+        """Return x in the space of the interpolator and whether it is within the data"""
+        x = np.asarray(x, dtype='f8')
+        inside = (x >= self.xrange[0]) & (x <= self.xrange[1])
         if self.log[0] == 1:
-            x_in = 10 ** x_in
-        
+            x = np.log10(x)
+        return x, inside
+
+    def func(self, x):
+        x_in, inside = self._fit_x(x)
+        f = self.interpolator()(x_in)
+
         if self.log[1] == 1:
-            f1 = lambda y: 10 ** f(y)
+            return np.where(inside, 10 ** f, 10 ** -100.)
         else:
-            f1 = f
-        
-        return f1(x_in)
+            return np.where(inside, f, 0.)
 
-    def show(self):
-        ax = plt.subplot(111)
-    
-        if self.log is not None:
+    __call__ = func
+
+    def derivative(self, order=1):
+        """Return a function giving the derivative of the given order.  For data that
+        is interpolated in log space only the first derivative is available; it is
+        obtained from the derivative of the spline by the chain rule."""
+        if order != 1 and (self.log[0] == 1 or self.log[1] == 1):
+            raise ValueError("Only the first derivative is available for log scaled data")
+        ds = self.interpolator().derivative(order)
+
+        def f(x):
+            x_in, inside = self._fit_x(x)
+            result = ds(x_in)
             if self.log[0] == 1:
-                ax.set_xscale('log')
+                result = result / (np.asarray(x) * np.log(10))
             if self.log[1] == 1:
-                ax.set_yscale('log')
-    
-        ax.set_ylabel(self.ytitle + ' [' + self.yunits + ']')
-        ax.set_xlabel(self.xtitle + ' [' + self.xunits + ']')
-        ax.set_title(self.name)
-        
-        num_points = self.x.shape[0]
-
-        fit_x = np.linspace(self.xrange[0], self.xrange[1], num = num_points*10)
-        fit_y = self.func(fit_x)
-        ax.plot(fit_x, fit_y, "-", color = 'blue')
-        
-        ax.plot(self.x, self.y, "o", color = 'red')
-
-        plt.show()
+                result = result * np.log(10) * 10 ** self.interpolator()(x_in)
+            return np.where(inside, result, 0.)
+        return f
+
+    def _quadrature(self, a, b):
+        """Gauss-Legendre integral of func between arrays of limits a and b"""
+        a, b = np.broadcast_arrays(np.asarray(a, dtype='f8'), np.asarray(b, dtype='f8'))
+        half_width = (b - a) / 2
+        nodes = ((b + a) / 2)[...,None] + half_width[...,None] * _nodes
+        return self.func(nodes).dot(_weights) * half_width
+
+    def antiderivative(self):
+        """Return the function F(x), the integral of the data from xrange[0] to x.
+        The data is taken to be zero outside of xrange.
+
+        Without log scaling this is the antiderivative of the spline.  Otherwise the
+        curve is integrated between consecutive samples with an 8 point Gauss-Legendre
+        rule, which is exact to rounding for data sampled finely enough to be
+        interpolated in the first place."""
+        x0, x1 = self.xrange
+        if self.log[0] != 1 and self.log[1] != 1:
+            integral = self.interpolator().antiderivative()
+            offset = integral(x0)
+            return lambda x: integral(np.clip(x, x0, x1)) - offset
+
+        knots = np.unique(self.x)
+        cumulative = np.concatenate(([0.], np.cumsum(self._quadrature(knots[:-1], knots[1:]))))
+
+        def f(x):
+            x = np.clip(np.asarray(x, dtype='f8'), x0, x1)
+            k = np.clip(np.searchsorted(knots, x, side='right') - 1, 0, len(knots) - 2)
+            return cumulative[k] + self._quadrature(knots[k], x)
+        return f
+
+    def integral(self, a, b):
+        """Integral of the data from a to b (arrays are broadcast), see antiderivative"""
+        f = self.antiderivative()
+        return f(b) - f(a)
+
+    def curve(self, oversample=10):
+        """Return the fit sampled on oversample times as many points as the data, for
+        plotting.  It is computed once and kept until the data change."""
+        if self._curve is None or self._curve[0] != oversample:
+            fit_x = np.linspace(self.xrange[0], self.xrange[1], num = self.x.shape[0]*oversample)
+            self._curve = (oversample, fit_x, self.func(fit_x))
+        return self._curve[1:]
+
+    def show(self, filename=None, max_points=2000):
+        """Plot the data and the fit.  If filename is given the plot is saved there
+        without pyplot (see heroes.util.plotting) instead of shown."""
+        from .util import plotting
+
+        fit_x, fit_y = self.curve()
+        curves = [(fit_x, fit_y, {'linestyle': '-', 'color': 'blue'}),
+                  (self.x, self.y, {'linestyle': '', 'marker': 'o', 'color': 'red'})]
+        labels = dict(xtitle=self.xtitle + ' [' + self.xunits + ']',
+                      ytitle=self.ytitle + ' [' + self.yunits + ']',
+                      title=self.name, log=self.log, max_points=max_points)
+        if filename is None:
+            plotting.show_curves(curves, **labels)
+        else:
+            return plotting.render_curves(filename, curves, **labels)
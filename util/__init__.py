@@ -1,6 +1,20 @@
 from __future__ import absolute_import
 
 from . util import *
+from . datafiles import *
+from . gaunt import *
+from . spectra import *
+from . effective_area import *
+from . pointing import *
+from . atmosphere import *
+from . telemetry import *
+from . plotting import *
+from . attenuation import *
+from . detector import *
+from . response import *
+from . detection import *
+from . fitting import *
+from . simulation import *
 
 #__all__ = []
 #__all__ += util.__all__
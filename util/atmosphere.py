@@ -0,0 +1,371 @@
+from __future__ import absolute_import
+
+__all__ = ["omniweb_fetcher", "staged_fetcher", "MSISProfileStore", "msis_store",
+           "standard_heights", "standard_atmosphere", "standard_atmosphere_profile",
+           "ColumnMassTable", "flight_track_transmission"]
+
+import os
+import io
+import hashlib
+import datetime
+import tempfile
+
+import numpy as np
+from scipy import interpolate
+
+from .datafiles import load_table, material_registry
+from .effective_area import _composite_rule
+
+# default height grid of the MSIS profiles: start, stop and step in km
+msis_heights = (0., 1000., 20.)
+# height grid on which the standard atmosphere is sampled for its column mass; the
+# 20 km MSIS grid overestimates the column at balloon altitudes by about 2%
+standard_heights = (0., 1000., 0.1)
+
+# date formats understood by _parse_date without sunpy (the common ones of
+# sunpy.time.parse_time)
+_date_formats = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M',
+                 '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+                 '%Y/%m/%dT%H:%M:%S', '%Y/%m/%d %H:%M:%S.%f', '%Y/%m/%d %H:%M:%S',
+                 '%Y/%m/%d %H:%M', '%Y/%m/%d', '%Y%m%dT%H%M%S', '%Y%m%d')
+
+def _parse_date(date):
+    '''Return a date as a datetime.  date is a datetime or date, an object with a
+    to_datetime method (such as an astropy Time), or a string in one of _date_formats
+    or, if sunpy can be imported, any other string sunpy.time.parse_time accepts
+    (e.g. 'Jan 1 2000')'''
+    if isinstance(date, datetime.datetime):
+        return date
+    if isinstance(date, datetime.date):
+        return datetime.datetime(date.year, date.month, date.day)
+    if hasattr(date, 'to_datetime'):
+        return date.to_datetime()
+    text = date.strip().rstrip('Z')
+    for date_format in _date_formats:
+        try:
+            return datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    try:
+        from sunpy.time import parse_time
+    except ImportError:
+        parse_time = None
+    if parse_time is not None:
+        try:
+            return _parse_date(parse_time(date))
+        except ValueError:
+            pass
+    raise ValueError("Cannot parse the date " + repr(date) + ", use a datetime or e.g. "
+                     "'2000/01/01 01:00:00'")
+
+def _parse_msis(text):
+    '''Parse the text returned by the omniweb MSIS model into a structured array of
+    height (x, km) and density (y, g/cm^3)'''
+    return np.genfromtxt(io.BytesIO(text), skip_header = 18, skip_footer = 16,
+                         dtype='f8,f8', names=['x','y'])
+
+def omniweb_fetcher(addr='http://omniweb.gsfc.nasa.gov/cgi/vitmo/vitmo_model.cgi'):
+    '''Return a fetcher for MSISProfileStore that runs the MSIS model on omniweb, or on
+    a local stand-in server answering the same form at addr.
+
+    Source
+    ------
+    http://omniweb.gsfc.nasa.gov/vitmo/msis_vitmo.html
+    '''
+    def fetch(t, latitude, longitude, heights):
+        try:
+            import urllib2 as url
+        except ImportError:
+            import urllib.request as url
+
+        vars = [5,11] # 5 is height, 11 is density g/cm^3
+
+        data = u'model=msis&year=' + str(t.year) + '&month=' + str(t.month).zfill(2)
+        data += '&day=' + str(t.day).zfill(2) + '&time_flag=0&hour='
+        data += str(t.hour).zfill(2) + '&geo_flag=0.&latitude='
+        data += str(latitude) + '&longitude=' + str(longitude)
+        data += u'&height=100.&profile=1&start=' + str(heights[0]) + '&stop=' + str(heights[1])
+        data += '&step=' + str(heights[2]) + '&f10_7=&f10_7_3=&ap=&format=0&'
+        data += 'vars=0' + str(vars[0]) + '&vars=0' + str(vars[1])
+        req = url.urlopen(url.Request(addr, data.encode('ascii')))
+        return _parse_msis(req.read())
+    return fetch
+
+def staged_fetcher(directory):
+    '''Return a fetcher for MSISProfileStore that reads pre-staged omniweb outputs
+    named <key>.txt from a directory, where key is MSISProfileStore.key of the request.'''
+    def fetch(t, latitude, longitude, heights):
+        filename = os.path.join(directory, MSISProfileStore.key(t, latitude, longitude, heights) + '.txt')
+        if not os.path.exists(filename):
+            raise IOError("No staged MSIS profile " + filename)
+        with open(filename, 'rb') as fp:
+            return _parse_msis(fp.read())
+    return fetch
+
+class MSISProfileStore(object):
+    """
+    An on-disk store of MSIS atmosphere profiles, so that a profile is fetched once
+    and can then be used by any process, including ones without network access.
+
+    Profiles are saved as .npy files named by the sha1 of their request: the date
+    (to the hour, the resolution of the model run), latitude, longitude and height
+    grid.  Reading a profile refreshes its modification time and the least recently
+    used profiles are removed when there are more than max_profiles.
+
+    Dates are datetimes, dates, astropy Times or strings such as '2000/01/01 01:00:00',
+    '2000-01-01T01:00:00' or '20000101' (the formats in _date_formats), so no time
+    parsing library is needed to use stored profiles.  Other strings that
+    sunpy.time.parse_time accepts, such as 'Jan 1 2000', need sunpy.
+
+    fetcher is called as fetcher(datetime, latitude, longitude, heights) and returns
+    the profile as a structured array with fields x (height, km) and y (density,
+    g/cm^3).  It defaults to omniweb_fetcher(); use staged_fetcher or a fetcher for a
+    local server on machines that cannot reach omniweb.
+
+    directory defaults to $HEROES_MSIS_CACHE or ~/.heroes/msis
+    """
+
+    def __init__(self, directory=None, max_profiles=1024, fetcher=None):
+        if directory is None:
+            directory = os.environ.get('HEROES_MSIS_CACHE',
+                                       os.path.join(os.path.expanduser('~'), '.heroes', 'msis'))
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.fetcher = omniweb_fetcher() if fetcher is None else fetcher
+        self._profiles = {}
+
+    @staticmethod
+    def key(date, latitude, longitude, heights=msis_heights):
+        t = _parse_date(date)
+        request = "msis {0:04d}-{1:02d}-{2:02d}T{3:02d} {4!r} {5!r} {6!r} {7!r} {8!r}".format(
+            t.year, t.month, t.day, t.hour, float(latitude), float(longitude),
+            *[float(h) for h in heights])
+        return hashlib.sha1(request.encode('ascii')).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def __contains__(self, request):
+        return os.path.exists(self.filename(self.key(*request)))
+
+    def get(self, date, latitude, longitude, heights=msis_heights, reload=False):
+        '''Return the profile for a request, fetching and storing it if necessary'''
+        key = self.key(date, latitude, longitude, heights)
+        filename = self.filename(key)
+
+        if not reload and key in self._profiles and os.path.exists(filename):
+            os.utime(filename, None)
+            return self._profiles[key]
+
+        if reload or not os.path.exists(filename):
+            self.put(date, latitude, longitude, self.fetcher(_parse_date(date), latitude, longitude, heights),
+                     heights=heights)
+        else:
+            os.utime(filename, None)
+        self._profiles[key] = np.load(filename)
+        return self._profiles[key]
+
+    def put(self, date, latitude, longitude, profile, heights=msis_heights):
+        '''Store a profile (structured array with fields x and y) for a request'''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        key = self.key(date, latitude, longitude, heights)
+        fd, temp_name = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as fp:
+            np.save(fp, np.asarray(profile))
+        # mkstemp makes the file private, other users of a shared store must read it
+        os.chmod(temp_name, 0o644)
+        os.rename(temp_name, self.filename(key))
+        self._profiles.pop(key, None)
+        self._evict()
+        return key
+
+    def prefetch(self, requests, heights=msis_heights):
+        '''Fetch and store every (date, latitude, longitude) request that is not
+        stored yet, e.g. all the points of a planned flight track.  Returns the keys.'''
+        keys = []
+        for date, latitude, longitude in requests:
+            if (date, latitude, longitude, heights) not in self:
+                self.get(date, latitude, longitude, heights)
+            keys.append(self.key(date, latitude, longitude, heights))
+        return keys
+
+    def clear(self):
+        for key in self._stored():
+            os.remove(self.filename(key))
+        self._profiles.clear()
+
+    def _stored(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [f[:-len('.npy')] for f in os.listdir(self.directory) if f.endswith('.npy')]
+
+    def _evict(self):
+        stored = self._stored()
+        if len(stored) > self.max_profiles:
+            stored.sort(key=lambda key: os.path.getmtime(self.filename(key)))
+            for key in stored[:len(stored) - self.max_profiles]:
+                os.remove(self.filename(key))
+                self._profiles.pop(key, None)
+
+msis_store = MSISProfileStore()
+
+# U.S. Standard Atmosphere 1976 layers below 86 km: base geopotential height (km),
+# temperature lapse rate (K/km), base temperature (K) and base pressure (Pa)
+_layer_height = np.array([0., 11., 20., 32., 47., 51., 71.])
+_layer_lapse_rate = np.array([-6.5, 0., 1.0, 2.8, 0., -2.8, -2.0])
+_layer_temperature = np.array([288.15, 216.65, 216.65, 228.65, 270.65, 270.65, 214.65])
+_layer_pressure = np.array([101325., 22632.06, 5474.889, 868.0187, 110.9063, 66.93887, 3.956420])
+
+_earth_radius_km = 6356.766
+_molar_mass = 0.0289644 # kg/mol
+_gas_constant = 8.31432 # J/mol/K
+_gmr = 34.1632 # g0 M / R in K/km
+
+def standard_atmosphere(height_km):
+    """
+    Returns the density (g/cm^3), temperature (K) and pressure (Pa) of the U.S.
+    Standard Atmosphere 1976 at heights given in km (any array shape).
+
+    Below 86 km the seven standard layers (troposphere, stratosphere, mesosphere)
+    are evaluated from their lapse rates.  Above that the tabulated profile in
+    us_standard_atmosphere_1976.txt is interpolated (log-linearly for pressure and
+    density), and extrapolated with its last scale height beyond 1000 km.
+    Needs no network access.
+
+    >>> density, temperature, pressure = standard_atmosphere(40.)
+    >>> round(float(temperature), 2), round(float(pressure), 1)
+    (250.35, 287.1)
+    >>> density, temperature, pressure = standard_atmosphere(100.)
+    >>> round(float(temperature), 1), round(float(pressure), 4)
+    (195.1, 0.032)
+    """
+    height_km = np.asarray(height_km, dtype='f8')
+    shape = height_km.shape
+    height_km = np.atleast_1d(height_km)
+
+    # geopotential height and layer of each point
+    h = _earth_radius_km * height_km / (_earth_radius_km + height_km)
+    i = np.clip(np.searchsorted(_layer_height, h, side='right') - 1, 0, len(_layer_height) - 1)
+    dh = h - _layer_height[i]
+    lapse_rate = _layer_lapse_rate[i]
+    base_temperature = _layer_temperature[i]
+
+    temperature = base_temperature + lapse_rate * dh
+    isothermal = lapse_rate == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponent = np.where(isothermal, 0., _gmr / np.where(isothermal, 1., lapse_rate))
+        pressure = _layer_pressure[i] * np.where(isothermal,
+                                                 np.exp(-_gmr * dh / base_temperature),
+                                                 (base_temperature / temperature) ** exponent)
+    density = pressure * _molar_mass / (_gas_constant * temperature)
+
+    upper = load_table('us_standard_atmosphere_1976.txt')
+    above = height_km > upper[0,0]
+    if np.any(above):
+        z = height_km[above]
+        temperature[above] = np.interp(z, upper[:,0], upper[:,1])
+        for result, column in ((pressure, 2), (density, 3)):
+            log_value = np.log(upper[:,column])
+            slope = (log_value[-1] - log_value[-2]) / (upper[-1,0] - upper[-2,0])
+            result[above] = np.exp(np.where(z > upper[-1,0],
+                                            log_value[-1] + slope * (z - upper[-1,0]),
+                                            np.interp(z, upper[:,0], log_value)))
+
+    # kg/m^3 to g/cm^3
+    return (density * 1e-3).reshape(shape), temperature.reshape(shape), pressure.reshape(shape)
+
+def standard_atmosphere_profile(heights=msis_heights):
+    '''Returns the standard atmosphere density as a structured array of height
+    (x, km) and density (y, g/cm^3) on a height grid (start, stop, step in km), by
+    default that of an MSIS profile, so that it can be used wherever an MSIS profile
+    is.  Use standard_heights for a ColumnMassTable.'''
+    height_km = np.arange(heights[0], heights[1] + heights[2] / 2., heights[2])
+    profile = np.zeros(len(height_km), dtype=[('x', 'f8'), ('y', 'f8')])
+    profile['x'] = height_km
+    profile['y'] = standard_atmosphere(height_km)[0]
+    return profile
+
+class ColumnMassTable(object):
+    """
+    The mass (g/cm^2) in a 1 sq cm column of air above any height, for a density
+    profile (structured array with fields x, height in km, and y, density in g/cm^3,
+    such as an MSIS or standard atmosphere profile).
+
+    The log of the density is fitted with a cubic spline, as atmosphere_density_fitdata
+    does, and integrated downwards once on a grid of step_km with a Gauss-Legendre
+    rule per step.  Queries, which may be arrays of any shape, are answered by cubic
+    Hermite interpolation of the log of the column mass, whose derivative is known
+    exactly (-density / column mass).  Above the top of the profile the density is
+    continued with its last scale height; below the bottom the column is that of the
+    bottom of the profile.
+    """
+
+    def __init__(self, profile, step_km=0.1, order=8):
+        height_km = np.asarray(profile['x'], dtype='f8')
+        log_density = interpolate.make_interp_spline(height_km, np.log10(profile['y']), k=3)
+
+        self.bottom_km = height_km[0]
+        self.top_km = height_km[-1]
+        self.scale_height_km = (height_km[-1] - height_km[-2]) / np.log(profile['y'][-2] / profile['y'][-1])
+        density = lambda z: 10 ** log_density(z)
+
+        grid = np.linspace(self.bottom_km, self.top_km, int(round((self.top_km - self.bottom_km) / step_km)) + 1)
+        nodes, weights = np.polynomial.legendre.leggauss(order)
+        half_width = (grid[1:] - grid[:-1]) / 2
+        steps = density((grid[1:] + grid[:-1])[:,None] / 2 + half_width[:,None] * nodes).dot(weights) * half_width
+
+        # km to cm, plus the tail above the top of the profile
+        top_column = density(self.top_km) * self.scale_height_km * 1e5
+        column = top_column + 1e5 * np.concatenate((np.cumsum(steps[::-1])[::-1], [0.]))
+
+        self.height_km = grid
+        self.column = column
+        self._log_column = interpolate.CubicHermiteSpline(grid, np.log(column),
+                                                          -1e5 * density(grid) / column)
+
+    def __call__(self, height_km):
+        height_km = np.asarray(height_km, dtype='f8')
+        log_column = self._log_column(np.clip(height_km, self.bottom_km, self.top_km))
+        log_column = log_column - np.maximum(height_km - self.top_km, 0) / self.scale_height_km
+        return np.exp(log_column)
+
+def flight_track_transmission(altitude_km, elevation_deg, energy_kev, column_mass, bands=None,
+                              material='air stp', order=8):
+    """
+    Atmospheric x-ray transmission along a flight track.
+
+    altitude_km and elevation_deg (of the source above the horizon) are time-ordered
+    arrays of n_t samples, e.g. from the gondola log, energy_kev an array of n_E
+    energies and column_mass a ColumnMassTable (or any vectorized function giving the
+    column mass in g/cm^2 above a height in km).  The column mass along the line of
+    sight is computed once per sample and the mass attenuation coefficient once per
+    energy, so the whole track is a single broadcast exponential.
+
+    Returns the transmission, of shape (n_t, n_E), and the average transmission over
+    each of the energy bands (a sequence of (low, high) in keV), of shape
+    (n_t, n_bands), or None if bands is None.  Band averages are integrated with an
+    order-point Gauss-Legendre rule between the energies tabulated for the material
+    rather than taken from the energy grid.  Sources at or below the horizon have no
+    transmission.
+    """
+    altitude_km = np.asarray(altitude_km, dtype='f8').ravel()
+    sin_elevation = np.sin(np.deg2rad(np.asarray(elevation_deg, dtype='f8'))).ravel()
+    energy_kev = np.asarray(energy_kev, dtype='f8').ravel()
+    mass_attenuation = material_registry.interpolator(material)
+
+    with np.errstate(divide='ignore'):
+        slant_column = np.where(sin_elevation > 0, column_mass(altitude_km) / sin_elevation, np.inf)
+    transmission = np.exp(-slant_column[:,None] * 10 ** mass_attenuation(np.log10(energy_kev)))
+
+    band_transmission = None
+    if bands is not None:
+        bands = np.atleast_2d(np.asarray(bands, dtype='f8'))
+        breaks = 10 ** material_registry.get(material)['log_energy_kev']
+        band_transmission = np.empty((len(slant_column), len(bands)))
+        for i, (low, high) in enumerate(bands):
+            energy, weights = _composite_rule(low, high, breaks, order)
+            mu = 10 ** mass_attenuation(np.log10(energy))
+            band_transmission[:,i] = np.exp(-slant_column[:,None] * mu).dot(weights) / (high - low)
+    return transmission, band_transmission
@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+
+__all__ = ["AttenuationLengthIndex", "attenuation_lengths", "attenuation_length_transmission",
+           "attenuation_length_absorption"]
+
+import io
+import os
+import re
+
+import numpy as np
+from scipy import interpolate
+
+from .datafiles import data_dir, load_table, _read_table
+
+class AttenuationLengthIndex(object):
+    """
+    The X-ray attenuation length tables (henke.lbl.gov, photon energy in eV against
+    attenuation length in microns) found in data_dir.
+
+    Files named <material>_xray_atten_length.txt or <material>_atten_len.txt are
+    indexed by material on first use, with the chemical formula and density (g/cm^3)
+    read from their header.  The table and the log-log interpolator of each material
+    are built once and kept.  Outside of its table a material has no attenuation
+    length (nan).
+    """
+
+    suffixes = ('_xray_atten_length.txt', '_atten_len.txt')
+
+    def __init__(self, directory=None):
+        self.directory = data_dir if directory is None else directory
+        self._index = None
+        self._tables = {}
+
+    def key(self, material):
+        return material.strip().lower().replace(' ', '_')
+
+    def scan(self):
+        '''Rebuild the index of materials from the files in the directory'''
+        self._index = {}
+        self._tables.clear()
+        for filename in sorted(os.listdir(self.directory)):
+            for suffix in self.suffixes:
+                if filename.endswith(suffix):
+                    self._index[filename[:-len(suffix)].lower()] = self._header(filename)
+        return self._index
+
+    def _header(self, filename):
+        '''Read the formula and density from a header line such as
+        "; C22H10N2O5 Density=1.43, Angle=90.deg"'''
+        entry = {'filename': filename, 'formula': None, 'density': None}
+        with io.open(os.path.join(self.directory, filename), encoding='latin-1') as fp:
+            for line in fp:
+                if not line.startswith(';'):
+                    break
+                match = re.search(r';\s*(\S+)\s+Density=([0-9.eE+-]+)', line)
+                if match:
+                    entry['formula'] = match.group(1)
+                    entry['density'] = float(match.group(2))
+        return entry
+
+    @property
+    def index(self):
+        if self._index is None:
+            self.scan()
+        return self._index
+
+    def available(self):
+        '''List the materials for which an attenuation length table exists'''
+        return sorted(self.index)
+
+    def __contains__(self, material):
+        return self.key(material) in self.index
+
+    def _entry(self, material):
+        key = self.key(material)
+        if key not in self.index:
+            raise ValueError("No attenuation length data for material '" + key +
+                             "'.  Available materials are " + ", ".join(self.available()))
+        return self.index[key]
+
+    def filename(self, material):
+        return os.path.join(self.directory, self._entry(material)['filename'])
+
+    def density(self, material):
+        '''Density (g/cm^3) the table was computed for'''
+        return self._entry(material)['density']
+
+    def formula(self, material):
+        return self._entry(material)['formula']
+
+    def get(self, material):
+        '''Return the table of a material as a dict with keys data, log_energy_kev,
+        log_length and interpolator (of log10 length against log10 energy in keV)'''
+        key = self.key(material)
+        if key not in self._tables:
+            filename = self._entry(key)['filename']
+            if self.directory == data_dir:
+                data = load_table(filename)
+            else:
+                data = _read_table(os.path.join(self.directory, filename))
+            log_energy_kev = np.log10(data[:,0] / 1000.)
+            log_length = np.log10(data[:,1])
+            f = interpolate.interp1d(log_energy_kev, log_length, assume_sorted=True,
+                                     bounds_error=False, fill_value=np.nan)
+            self._tables[key] = {"data": data, "log_energy_kev": log_energy_kev,
+                                 "log_length": log_length, "interpolator": f}
+        return self._tables[key]
+
+    def energy_range(self, material):
+        '''Energies (keV) covered by the table of a material'''
+        log_energy_kev = self.get(material)['log_energy_kev']
+        return 10 ** log_energy_kev[0], 10 ** log_energy_kev[-1]
+
+    def attenuation_length(self, energy_kev, material):
+        '''Attenuation length (microns) at energies (keV) of any shape'''
+        f = self.get(material)['interpolator']
+        return 10 ** f(np.log10(np.asarray(energy_kev, dtype='f8')))
+
+attenuation_lengths = AttenuationLengthIndex()
+
+def attenuation_length_transmission(energy_kev, material, thickness_um, angle_deg=0):
+    """
+    Returns the X-ray transmission through a layer of material thickness_um microns
+    thick, for X-rays at energies in keV arriving angle_deg degrees from the normal of
+    the layer, from its attenuation length table (see attenuation_lengths).
+
+    energy_kev, thickness_um and angle_deg are broadcast against each other, e.g.
+    energy_kev[None,None,:], thickness_um[:,None,None] and angle_deg[None,:,None] for
+    the full grid of thicknesses, angles and energies.  The tables are finer than
+    the NIST mass attenuation tables below 25-30 keV and suit thin filters; outside
+    of them the result is nan.
+    """
+    length_um = attenuation_lengths.attenuation_length(energy_kev, material)
+    path_um = np.asarray(thickness_um, dtype='f8') / np.cos(np.deg2rad(angle_deg))
+    return np.exp(-path_um / length_um)
+
+def attenuation_length_absorption(energy_kev, material, thickness_um, angle_deg=0):
+    '''Returns the fraction of X-rays absorbed in a layer, see
+    attenuation_length_transmission'''
+    length_um = attenuation_lengths.attenuation_length(energy_kev, material)
+    path_um = np.asarray(thickness_um, dtype='f8') / np.cos(np.deg2rad(angle_deg))
+    return -np.expm1(-path_um / length_um)
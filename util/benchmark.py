@@ -0,0 +1,60 @@
+"""
+Import-time benchmark for heroes.
+
+Plotting (matplotlib), time parsing (sunpy) and the MSIS download (urllib) are only
+imported when they are first used, so that batch workers computing transmissions and
+effective areas start quickly and run on nodes without a display.  Run
+
+    python -m heroes.util.benchmark
+
+to time a fresh import of heroes and check that none of these modules is loaded; it
+exits with an error if one is, or if the import takes longer than the budget.
+
+scipy.optimize is not among them: scipy.interpolate, which heroes needs at import,
+imports it itself, so importing it inside fitfunc does not keep it out.
+"""
+from __future__ import absolute_import, print_function
+
+import sys
+import json
+import subprocess
+
+# modules that must not be imported by "import heroes"
+lazy_modules = ('matplotlib', 'sunpy', 'urllib2', 'urllib.request')
+
+_probe = """
+import sys, time, json
+start = time.time()
+import {0}
+elapsed = time.time() - start
+print(json.dumps([elapsed, sorted(m for m in {1!r} if m in sys.modules)]))
+"""
+
+def import_time(module='heroes', repeat=5):
+    '''Returns the shortest time (s) to import module in a fresh interpreter, out of
+    repeat tries, and the lazy_modules that the import loaded'''
+    best = None
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _probe.format(module, lazy_modules)])
+        elapsed, loaded = json.loads(output.decode('ascii').strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best, loaded
+
+def check_import(module='heroes', budget=1.0, repeat=5):
+    '''Raises RuntimeError if importing module loads any of lazy_modules or takes
+    longer than budget (s).  Returns the import time.'''
+    elapsed, loaded = import_time(module, repeat)
+    if loaded:
+        raise RuntimeError("import " + module + " loaded " + ", ".join(loaded))
+    if elapsed > budget:
+        raise RuntimeError("import {0} took {1:.3f} s, over the budget of {2:.3f} s".format(module, elapsed, budget))
+    return elapsed
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    try:
+        elapsed = check_import(budget=budget)
+    except RuntimeError as error:
+        print(error)
+        sys.exit(1)
+    print("import heroes: {0:.3f} s (budget {1:.3f} s)".format(elapsed, budget))
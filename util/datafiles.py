@@ -0,0 +1,247 @@
+from __future__ import absolute_import
+
+__all__ = ["data_dir", "table_names", "load_table", "build_data_bundle",
+           "density", "MaterialRegistry", "material_registry"]
+
+import os
+import io
+import json
+import hashlib
+import tempfile
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+from scipy import interpolate
+
+try:
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),"data","")
+except AttributeError:
+    data_dir = '/Users/schriste/Dropbox/python/heroes/util/data/'
+
+# The binary bundle is a single flat float64 .npy file holding every table in
+# data_dir back to back, plus a json index of (offset, shape, and sha1, size and
+# modification time of the ASCII source) per table.  It is produced by build_data_bundle() and is optional.
+bundle_file = os.path.join(data_dir, 'heroes_data.npy')
+bundle_index_file = os.path.join(data_dir, 'heroes_data.json')
+
+_tables = {}
+_bundle = None
+
+def _read_table(filename, comments=';'):
+    '''Read the numeric rows of an ASCII table.  Comment lines and the text headers
+    (column names, units) that the NIST and CXRO files carry are skipped, as are
+    rows that do not have the same number of columns as the table body.'''
+
+    rows = []
+    with io.open(filename, encoding='latin-1') as fp:
+        for line in fp:
+            line = line.split(comments)[0].replace(',', ' ').split()
+            if len(line) == 0:
+                continue
+            try:
+                rows.append([float(value) for value in line])
+            except ValueError:
+                continue
+
+    counts = [len(row) for row in rows]
+    ncols = max(set(counts), key=counts.count)
+    return np.array([row for row in rows if len(row) == ncols])
+
+def _checksum(filename):
+    with open(filename, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+def _up_to_date(source, entry, checksum):
+    '''Whether a bundle entry matches its ASCII source: same size and modification
+    time, or same sha1 if checksum is true (or the index predates sizes and times)'''
+    if checksum or "mtime" not in entry:
+        return _checksum(source) == entry["sha1"]
+    stat = os.stat(source)
+    return stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]
+
+def table_names():
+    '''List the ASCII tables shipped in data_dir.'''
+    return sorted(f for f in os.listdir(data_dir) if f.endswith(('.txt', '.dat')))
+
+def build_data_bundle():
+    '''Convert every ASCII table in data_dir into the binary bundle read by load_table.
+    Returns the index (table name -> offset, shape and sha1, size and modification
+    time of the ASCII source).
+
+    Run it once after the data files change, e.g. python -m heroes.util.datafiles'''
+
+    global _bundle
+
+    index = {}
+    arrays = []
+    offset = 0
+    for name in table_names():
+        filename = os.path.join(data_dir, name)
+        data = _read_table(filename).astype('f8')
+        stat = os.stat(filename)
+        index[name] = {"offset": offset, "shape": list(data.shape), "sha1": _checksum(filename),
+                       "size": stat.st_size, "mtime": stat.st_mtime}
+        arrays.append(data.ravel())
+        offset += data.size
+
+    # write to temporary files and rename so that processes already reading the
+    # bundle never see a partially written file
+    for target, write in ((bundle_file, lambda fp: np.save(fp, np.concatenate(arrays))),
+                          (bundle_index_file, lambda fp: fp.write(json.dumps(index, indent=1, sort_keys=True).encode('ascii')))):
+        fd, temp_name = tempfile.mkstemp(dir=data_dir)
+        with os.fdopen(fd, 'wb') as fp:
+            write(fp)
+        # mkstemp makes the file private, other users of a shared install must read it
+        os.chmod(temp_name, 0o644)
+        os.rename(temp_name, target)
+
+    _bundle = None
+    _tables.clear()
+    return index
+
+def _open_bundle():
+    global _bundle
+
+    if _bundle is None:
+        _bundle = (None, {})
+        if os.path.exists(bundle_file) and os.path.exists(bundle_index_file):
+            # an unreadable bundle (e.g. no permission) falls back to the ASCII files
+            try:
+                with open(bundle_index_file) as fp:
+                    index = json.load(fp)
+                _bundle = (np.load(bundle_file, mmap_mode='r'), index)
+            except (IOError, OSError):
+                pass
+    return _bundle
+
+def _load_from_bundle(name, verify):
+    flat, index = _open_bundle()
+    entry = index.get(name)
+    if entry is None:
+        return None
+
+    source = os.path.join(data_dir, name)
+    if verify and os.path.exists(source) and not _up_to_date(source, entry, verify == 'sha1'):
+        warnings.warn("The data bundle is out of date for " + name + ", reading the ASCII " +
+                      "file instead.  Rerun build_data_bundle() to refresh it.")
+        return None
+
+    size = int(np.prod(entry["shape"]))
+    return flat[entry["offset"]:entry["offset"] + size].reshape(entry["shape"])
+
+def load_table(name, verify=True):
+    '''Return the numeric contents of a table in data_dir (e.g. 'itoh.txt') as a
+    read-only 2D array.  When the binary bundle exists and the size and modification
+    time recorded for the table match its ASCII source (its sha1 with verify='sha1',
+    nothing with verify=False), the array is a view of the memory-mapped bundle and
+    nothing is copied; otherwise the ASCII file is parsed.  Either way each table is
+    read at most once per process.'''
+
+    data = _tables.get(name)
+    if data is None:
+        data = _load_from_bundle(name, verify)
+        if data is None:
+            data = _read_table(os.path.join(data_dir, name))
+            data.flags.writeable = False
+        _tables[name] = data
+    return data
+
+# densities (g/cm^3) of the materials with mass attenuation tables
+# source; wolframalpha
+density = {"air stp": 0.001204, "si": 2.33, "be": 1.848, "water": 1, "cadmium telluride": 6.2, 
+"cesium iodide": 4.51, "gallium arsenide": 5.31, "mercuric iodide": 6.36, "lead glass": 6.22,
+"mylar": 1.40, "kapton": 1.43}
+
+class MaterialRegistry(object):
+    """A process-wide cache of the NIST X-ray mass attenuation tables.
+
+    Each XrayMassCoef_*.txt file is parsed once.  The table, its log10 energy (keV)
+    and log10 mu/rho (cm2/g) columns and the interpolator built on them are kept
+    in a bounded least-recently-used cache keyed by material."""
+
+    # material names used elsewhere in heroes which do not match a file name
+    aliases = {"water": "water_liquid", "air": "air_stp", "cdte": "cadmium_telluride"}
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def key(self, material):
+        '''Return the cache key (the file name stem) for a material name such as
+        "air stp" or "Cadmium Telluride".'''
+        key = material.strip().lower().replace(' ', '_')
+        return self.aliases.get(key, key)
+
+    def filename(self, material):
+        return os.path.join(data_dir, 'XrayMassCoef_' + self.key(material) + '.txt')
+
+    def available(self):
+        '''List the materials for which a mass attenuation table exists.'''
+        return sorted(f[len('XrayMassCoef_'):-len('.txt')] for f in os.listdir(data_dir)
+                      if f.startswith('XrayMassCoef_') and f.endswith('.txt'))
+
+    def get(self, material):
+        '''Return the cached entry for a material, parsing its table on first use.
+        The entry is a dict with keys data, log_energy_kev, log_mu and interpolator.'''
+
+        key = self.key(material)
+        entry = self._cache.pop(key, None)
+        if entry is None:
+            entry = self._load(key)
+        self._cache[key] = entry
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return entry
+
+    def density(self, material):
+        '''Return the density (g/cm^3) of a material, see density'''
+        key = self.key(material)
+        for name, value in density.items():
+            if self.key(name) == key:
+                return value
+        raise ValueError("No density for material '" + key + "'")
+
+    def interpolator(self, material):
+        '''Return the interpolator of log10 mu/rho against log10 energy (keV).'''
+        return self.get(material)['interpolator']
+
+    def preload(self, materials=None):
+        '''Parse the tables for a list of materials (default: all available) so
+        that later lookups never touch the disk.'''
+        if materials is None:
+            materials = self.available()
+        for material in materials:
+            self.get(material)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __contains__(self, material):
+        return self.key(material) in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _load(self, key):
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            raise ValueError("No mass attenuation data for material '" + key +
+                             "'.  Available materials are " + ", ".join(self.available()))
+
+        data = load_table(os.path.basename(filename))
+
+        # data is better behaved in log space
+        log_energy_kev = np.log10(data[:,0]*1000)
+        log_mu = np.log10(data[:,1])
+        # the tables are sorted in energy and repeat the energy at absorption edges,
+        # so keep the file order rather than letting interp1d re-sort
+        f = interpolate.interp1d(log_energy_kev, log_mu, assume_sorted=True)
+
+        return {"data": data, "log_energy_kev": log_energy_kev, "log_mu": log_mu,
+                "interpolator": f}
+
+material_registry = MaterialRegistry()
+
+if __name__ == '__main__':
+    build_data_bundle()
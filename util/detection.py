@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+
+__all__ = ["detection_limit_counts", "band_response", "sensitivity_surface"]
+
+import numpy as np
+
+from .effective_area import heroes_effective_area, heroes_effective_area_spline, _composite_rule
+from .atmosphere import flight_track_transmission
+from .detector import detector_response
+
+def detection_limit_counts(background_counts, statistical_significance=5):
+    """Returns the source counts needed for a detection at a significance K (in sigma)
+    over a background, from
+
+        K = signal / sqrt(signal + background)
+
+    which solves to
+
+        signal = (K^2 + sqrt(K^4 + 4 K^2 background)) / 2
+
+    Arguments are broadcast against each other."""
+    k2 = np.asarray(statistical_significance, dtype='f8') ** 2
+    return (k2 + np.sqrt(k2 ** 2 + 4 * k2 * np.asarray(background_counts, dtype='f8'))) / 2
+
+def _bands(band_edges_kev):
+    '''(n_band, 2) array of (low, high) from contiguous edges or from pairs'''
+    band_edges_kev = np.asarray(band_edges_kev, dtype='f8')
+    if band_edges_kev.ndim == 1:
+        return np.column_stack((band_edges_kev[:-1], band_edges_kev[1:]))
+    return band_edges_kev
+
+def band_response(band_edges_kev, altitude_km, column_mass, elevation_deg=90, offaxis_arcmin=0,
+                  modules=None, detector='cadmium telluride', detector_thickness_um=None,
+                  filters=(), order=4):
+    """
+    Returns the band averaged effective area x atmospheric transmission x detector
+    efficiency (cm^2), of shape (n_alt, n_band), for an array of altitudes (km).
+
+    band_edges_kev is either n_band+1 contiguous edges or n_band (low, high) pairs.
+    Each band is integrated with Gauss-Legendre panels between the knots of the
+    effective area spline; the transmission at all altitudes and nodes is one call to
+    flight_track_transmission.  No detector efficiency is applied if
+    detector_thickness_um is None.
+    """
+    bands = _bands(band_edges_kev)
+    altitude_km = np.atleast_1d(np.asarray(altitude_km, dtype='f8'))
+    knots = heroes_effective_area_spline(modules).get_knots()[0]
+
+    rules = [_composite_rule(low, high, knots, order) for low, high in bands]
+    energy = np.concatenate([e for e, w in rules])
+    response = heroes_effective_area(energy, offaxis_arcmin, modules=modules)
+    if detector_thickness_um is not None:
+        response = response * detector_response(energy, detector_thickness_um, detector,
+                                                 materials=[m for m, t in filters],
+                                                 thickness_um=[t for m, t in filters])
+    response = response * flight_track_transmission(altitude_km, np.full(altitude_km.shape, elevation_deg),
+                                                    energy, column_mass)[0]
+
+    result = np.empty((len(altitude_km), len(bands)))
+    start = 0
+    for i, ((low, high), (e, w)) in enumerate(zip(bands, rules)):
+        result[:,i] = response[:,start:start + len(e)].dot(w) / (high - low)
+        start += len(e)
+    return result
+
+def sensitivity_surface(integration_time, band_edges_kev, statistical_significance, altitude_km,
+                        background, column_mass, background_area=8 * 0.04, fraction_flux=0.8,
+                        order=4, **kwargs):
+    """
+    Returns the HEROES sensitivity (the smallest detectable photon flux, photons s^-1
+    cm^-2 keV^-1) for every combination of integration times (s), energy bands (see
+    band_response), significance levels (sigma) and altitudes (km), as an array of
+    shape (n_time, n_significance, n_altitude, n_band).
+
+    background is the detector background (counts s^-1 keV^-1 cm^-2) as a number or a
+    function of energy, integrated over each band and over background_area (cm^2).
+    fraction_flux is the fraction of the source flux in the extraction region.  Other
+    keywords (elevation_deg, offaxis_arcmin, modules, detector, detector_thickness_um,
+    filters) are passed to band_response; the response is computed once for all the
+    scenarios.
+    """
+    bands = _bands(band_edges_kev)
+    width = bands[:,1] - bands[:,0]
+    integration_time = np.atleast_1d(np.asarray(integration_time, dtype='f8'))[:,None,None,None]
+    significance = np.atleast_1d(np.asarray(statistical_significance, dtype='f8'))[None,:,None,None]
+
+    if callable(background):
+        nodes, weights = np.polynomial.legendre.leggauss(order)
+        energy = (bands[:,1] + bands[:,0])[:,None] / 2 + width[:,None] / 2 * nodes
+        background_rate = background(energy).dot(weights) / 2
+    else:
+        background_rate = np.full(len(bands), float(background))
+
+    response = band_response(bands, altitude_km, column_mass, order=order, **kwargs)[None,None,:,:]
+    background_counts = background_rate * width * background_area * integration_time
+    signal = detection_limit_counts(background_counts, significance)
+    return signal / (response * width * integration_time * fraction_flux)
@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+__all__ = ["attenuation_coefficient", "stack_transmission", "detector_absorption",
+           "detector_response"]
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from .datafiles import material_registry
+from .attenuation import attenuation_lengths
+
+# attenuation coefficients on recently used energy grids, by (material, grid)
+_coefficients = OrderedDict()
+_max_coefficients = 64
+
+def _linear_coefficient(energy_kev, material, source):
+    '''Linear attenuation coefficient (1/cm) of a material at energies in keV'''
+    nist = os.path.exists(material_registry.filename(material))
+    if nist and (source == 'nist' or material not in attenuation_lengths):
+        f = material_registry.interpolator(material)
+        return 10 ** f(np.log10(energy_kev)) * material_registry.density(material)
+
+    if material not in attenuation_lengths:
+        raise ValueError("No attenuation data for material '" + material + "'")
+    # attenuation length in microns, nan outside of its table, at the density of the
+    # NIST table if there is one so that both tables describe the same material
+    mu = 1e4 / attenuation_lengths.attenuation_length(energy_kev, material)
+    if nist:
+        mu *= material_registry.density(material) / attenuation_lengths.density(material)
+        outside = np.isnan(mu)
+        if np.any(outside):
+            mu[outside] = _linear_coefficient(energy_kev[outside], material, 'nist')
+    return mu
+
+def attenuation_coefficient(energy_kev, material, source='nist'):
+    """
+    Returns the linear attenuation coefficient (1/cm) of a material at energies
+    given in keV (an array of any shape).
+
+    source is the table that wins for a material that has both: 'nist' for its NIST
+    mass attenuation table (see material_registry) with its density, or
+    'atten_length' for its finer attenuation length table (see attenuation_lengths,
+    e.g. for thin filters), scaled to the density of the NIST table and with the NIST
+    table outside of the energies it covers.
+    A material with only one table uses it, and is nan outside of an attenuation
+    length table.  The coefficients on an energy grid are computed once and kept for
+    the most recently used grids, so must not be modified.
+    """
+    if source not in ('nist', 'atten_length'):
+        raise ValueError("Invalid attenuation data source " + str(source))
+    energy_kev = np.asarray(energy_kev, dtype='f8')
+    key = (material.strip().lower(), source, energy_kev.shape, energy_kev.tobytes())
+
+    mu = _coefficients.pop(key, None)
+    if mu is None:
+        mu = _linear_coefficient(energy_kev.ravel(), material, source).reshape(energy_kev.shape)
+        mu.flags.writeable = False
+    _coefficients[key] = mu
+    while len(_coefficients) > _max_coefficients:
+        _coefficients.popitem(last=False)
+    return mu
+
+def stack_transmission(energy_kev, materials, thickness_um, angle_deg=0, source='nist'):
+    """
+    Returns the X-ray transmission through a stack of layers (filters, blankets, air)
+    at energies given in keV, for X-rays arriving angle_deg degrees from the normal.
+
+    materials names the n_layers layers and thickness_um (microns) has shape
+    (..., n_layers), so a batch of stack configurations with the same materials is
+    evaluated at once; the result has shape (...) + energy_kev.shape.  A layer can be
+    left out of a configuration with a thickness of 0.  angle_deg is broadcast
+    against thickness_um[...,0].  source selects the attenuation tables, see
+    attenuation_coefficient.
+    """
+    energy_kev = np.asarray(energy_kev, dtype='f8')
+    thickness_um = np.asarray(thickness_um, dtype='f8')
+    thickness_um = thickness_um / np.cos(np.deg2rad(np.asarray(angle_deg, dtype='f8')))[...,None]
+    if len(materials) == 0:
+        return np.ones(thickness_um.shape[:-1] + energy_kev.shape)
+
+    mu = np.array([attenuation_coefficient(energy_kev, material, source).ravel() for material in materials])
+    return np.exp(-np.dot(thickness_um * 1e-4, mu)).reshape(thickness_um.shape[:-1] + energy_kev.shape)
+
+def detector_absorption(energy_kev, thickness_um, material='cadmium telluride', angle_deg=0, source='nist'):
+    '''Returns the fraction of X-rays at energies given in keV absorbed in a detector
+    of thickness_um microns, arriving angle_deg degrees from its normal.  thickness_um
+    and angle_deg are broadcast against energy_kev; source selects the attenuation
+    tables, see attenuation_coefficient'''
+    mu = attenuation_coefficient(energy_kev, material, source)
+    path_um = np.asarray(thickness_um, dtype='f8') / np.cos(np.deg2rad(angle_deg))
+    return -np.expm1(-mu * path_um * 1e-4)
+
+def detector_response(energy_kev, detector_thickness_um, detector='cadmium telluride',
+                      materials=(), thickness_um=(), angle_deg=0, source='nist'):
+    """
+    Returns the detector efficiency (0 to 1) at energies given in keV: the transmission
+    through a stack of filters (see stack_transmission) times the absorption in the
+    detector (see detector_absorption).
+
+    detector_thickness_um has shape (...) and thickness_um (..., n_layers); they are
+    broadcast (with angle_deg, the angle from the normal of the stack) to give a
+    result of shape (...) + energy_kev.shape, e.g. for thousands of candidate filter
+    configurations in one call.  source selects the attenuation tables of the filters
+    and the detector, see attenuation_coefficient.
+    """
+    energy_kev = np.asarray(energy_kev, dtype='f8')
+    detector_thickness_um = np.asarray(detector_thickness_um, dtype='f8')
+    thickness_um = np.asarray(thickness_um, dtype='f8').reshape(np.shape(thickness_um)[:-1] + (len(materials),))
+
+    angle_deg = np.asarray(angle_deg, dtype='f8')
+
+    transmission = stack_transmission(energy_kev, materials, thickness_um, angle_deg=angle_deg, source=source)
+    detector_thickness_um = detector_thickness_um.reshape(detector_thickness_um.shape + (1,) * energy_kev.ndim)
+    angle_deg = angle_deg.reshape(angle_deg.shape + (1,) * energy_kev.ndim)
+    absorption = detector_absorption(energy_kev, detector_thickness_um, material=detector, angle_deg=angle_deg,
+                                     source=source)
+    return transmission * absorption
@@ -0,0 +1,251 @@
+from __future__ import absolute_import
+
+__all__ = ["heroes_modules", "heroes_effective_area_spline", "heroes_effective_area",
+           "effective_area_cubature", "tophat_weight", "gaussian_weight",
+           "GaussianExposureTable"]
+
+import os
+import hashlib
+
+import numpy as np
+from scipy import interpolate
+from scipy import special
+
+from .datafiles import data_dir, load_table
+
+# Total effective area is 3 13-shell modules and 5 14-shell modules
+# Count verified on 2012 Oct 22
+heroes_modules = ((13, 3), (14, 5))
+
+_splines = {}
+_gauss_legendre = {}
+
+def _shell_file(shells):
+    return 'aeff_' + str(shells) + 'shells_sky.dat'
+
+def _modules_key(modules):
+    if modules is None:
+        modules = heroes_modules
+    elif isinstance(modules, dict):
+        modules = modules.items()
+    return tuple(sorted((int(shells), int(number)) for shells, number in modules))
+
+def heroes_effective_area_spline(modules=None):
+    '''Return the spline of the total HEROES effective area (cm^2) as a function of
+    energy (keV, 17.5 to 80) and off-axis angle (arcmin, 0 to 12).
+
+    modules is a sequence of (number of shells, number of modules) pairs or a dict
+    {shells: modules}, by default heroes_modules.  The spline is built once per
+    module configuration and shared, so it must not be modified.'''
+
+    key = _modules_key(modules)
+    if key not in _splines:
+        area = 0
+        for shells, number in key:
+            data = load_table(_shell_file(shells))
+            area = area + number * data[:,1:]
+
+        energy = data[:,0] # keV, axis assumed to be the same in all files
+        theta = np.arange(data.shape[1] - 1) # arcmin
+        _splines[key] = interpolate.RectBivariateSpline(energy, theta, area)
+    return _splines[key]
+
+def heroes_effective_area(energy_kev, offaxis_arcmin=0, modules=None):
+    '''Return the total HEROES effective area (cm^2) at arbitrary arrays of energies
+    (keV) and off-axis angles (arcmin), which are broadcast against each other.  All
+    points are evaluated in a single call to the compiled spline evaluator.'''
+
+    energy_kev, offaxis_arcmin = np.broadcast_arrays(np.asarray(energy_kev, dtype='f8'),
+                                                     np.asarray(offaxis_arcmin, dtype='f8'))
+    f2d = heroes_effective_area_spline(modules)
+    return f2d.ev(energy_kev.ravel(), offaxis_arcmin.ravel()).reshape(energy_kev.shape)
+
+def _composite_rule(a, b, breaks, order):
+    '''Nodes and weights of a composite Gauss-Legendre rule on [a, b] with one panel
+    between each pair of consecutive breaks'''
+    if order not in _gauss_legendre:
+        _gauss_legendre[order] = np.polynomial.legendre.leggauss(order)
+    nodes, weights = _gauss_legendre[order]
+
+    breaks = np.asarray(breaks, dtype='f8')
+    edges = np.unique(np.concatenate(([a, b], breaks[(breaks > a) & (breaks < b)])))
+    half_width = (edges[1:] - edges[:-1]) / 2
+    centre = (edges[1:] + edges[:-1]) / 2
+    x = (centre[:,None] + half_width[:,None] * nodes).ravel()
+    w = (half_width[:,None] * weights).ravel()
+    return x, w
+
+def effective_area_cubature(energy_range, radius, weight, breaks=(), tolerance=1e-6,
+                            order=4, max_order=256, modules=None):
+    """
+    Integrates the HEROES effective area over an energy range and off-axis angle
+
+        int int A(e, r) weight(r) dr de / (energy_range[1] - energy_range[0])
+
+    with r from 0 to radius.  weight is a vectorized function of r giving the radial
+    exposure density (including the Jacobian, e.g. 2 r / radius^2 for a tophat).
+
+    The integral is a tensor-product composite Gauss-Legendre rule with panels
+    between the knots of the effective area spline (and at breaks, for weights that
+    are only piecewise smooth), so the spline is evaluated once on the whole node
+    grid.  The order is doubled until two successive estimates agree to within
+    tolerance (relative) or max_order is reached.
+
+    Returns the average area (cm^2) and an estimate of its absolute error.
+
+    energy_range is in keV
+    radius is in arcmin
+    """
+    f2d = heroes_effective_area_spline(modules)
+    energy_knots, theta_knots = f2d.get_knots()
+    theta_breaks = np.concatenate((theta_knots, breaks))
+
+    def average(order):
+        e, we = _composite_rule(energy_range[0], energy_range[1], energy_knots, order)
+        r, wr = _composite_rule(0, radius, theta_breaks, order)
+        return we.dot(f2d(e, r).dot(wr * weight(r))) / (energy_range[1] - energy_range[0])
+
+    area, error = _converge(average, tolerance, order, max_order)
+    return area, float(error)
+
+def _converge(estimate, tolerance, order=4, max_order=256):
+    '''Doubles the order of estimate(order), a number or an array, until two successive
+    estimates agree to within tolerance (relative, everywhere) or max_order is
+    reached.  Returns the last estimate and its absolute difference from the one
+    before.'''
+    previous = estimate(order)
+    while True:
+        order *= 2
+        current = estimate(order)
+        error = np.abs(current - previous)
+        if np.all(error <= tolerance * np.abs(current)) or order >= max_order:
+            return current, error
+        previous = current
+
+def tophat_weight(radius):
+    '''Radial exposure density of a uniform exposure over a disc of a radius (arcmin)'''
+    return lambda r: 2 * r / radius ** 2
+
+def gaussian_weight(fwhm, offaxis=0):
+    '''Radial exposure density of a circular Gaussian exposure (fwhm in arcmin) centred
+    offaxis arcmin from the optical axis.  The effective area only depends on the
+    off-axis angle, so the azimuthal integral over the disc is done analytically:
+
+        int_0^2pi exp(-|x - x0|^2 / 2 sigma^2) dphi = 2 pi exp(-(r^2 + r0^2) / 2 sigma^2) I0(r r0 / sigma^2)
+
+    and the exponentially scaled Bessel function keeps it finite far off axis.'''
+    sigma = fwhm / 2.355
+    offaxis = abs(offaxis)
+    return lambda r: (r * np.exp(-(r - offaxis) ** 2 / sigma ** 2 / 2) *
+                      special.i0e(r * offaxis / sigma ** 2) / sigma ** 2)
+
+def _source_hash(modules):
+    '''sha1 of the module configuration and of the effective area files it uses'''
+    key = _modules_key(modules)
+    sha1 = hashlib.sha1(repr(key).encode('ascii'))
+    for shells, number in key:
+        with open(os.path.join(data_dir, _shell_file(shells)), 'rb') as fp:
+            sha1.update(fp.read())
+    return sha1.hexdigest()
+
+class GaussianExposureTable(object):
+    """
+    A precomputed table of heroes_effective_area_gaussian over a list of energy
+    bands and regular grids of fwhm, radius and offaxis (all in arcmin), answering
+    queries by interpolation in (fwhm, offaxis, radius) within each band.
+
+    The table is built with vectorized cubature: for each band and radius the
+    energy-averaged effective area is computed once on the radial nodes and then
+    weighted by the Gaussian exposure of every (fwhm, offaxis) pair at once.  The
+    largest relative difference between the last two quadrature orders is kept
+    in max_error.
+
+    Queries for bands that are not in the table, or outside its grid, fall back
+    to the direct integral.  save() writes the table with its parameters and a hash
+    of the effective area data; load() refuses a table whose hash does not match.
+    """
+
+    def __init__(self, bands, fwhm, radius, offaxis, modules=None, tolerance=1e-6,
+                 method='linear', area=None, max_error=None):
+        self.bands = np.atleast_2d(np.asarray(bands, dtype='f8'))
+        self.fwhm = np.asarray(fwhm, dtype='f8')
+        self.offaxis = np.asarray(offaxis, dtype='f8')
+        self.radius = np.asarray(radius, dtype='f8')
+        self.modules = _modules_key(modules)
+        self.tolerance = tolerance
+        self.method = method
+        self.source_hash = _source_hash(self.modules)
+
+        if area is None:
+            area, max_error = self._tabulate()
+        self.area = area
+        self.max_error = max_error
+        self._interpolators = [interpolate.RegularGridInterpolator((self.fwhm, self.offaxis, self.radius),
+                                                                   band_area, method=method)
+                               for band_area in self.area]
+
+    def _tabulate(self):
+        f2d = heroes_effective_area_spline(self.modules)
+        energy_knots, theta_knots = f2d.get_knots()
+        # radial exposure density of every (fwhm, offaxis) pair, as a function of r
+        weight = gaussian_weight(self.fwhm[:,None,None], self.offaxis[None,:,None])
+
+        area = np.empty((len(self.bands), len(self.fwhm), len(self.offaxis), len(self.radius)))
+        max_error = 0.
+        for i, energy_range in enumerate(self.bands):
+            for k, radius in enumerate(self.radius):
+                def average(order):
+                    e, we = _composite_rule(energy_range[0], energy_range[1], energy_knots, order)
+                    r, wr = _composite_rule(0, radius, theta_knots, order)
+                    radial = we.dot(f2d(e, r)) / (energy_range[1] - energy_range[0])
+                    return weight(r).dot(wr * radial)
+
+                current, error = _converge(average, self.tolerance)
+                area[i,:,:,k] = current
+                max_error = max(max_error, np.max(error / np.abs(current)))
+        return area, max_error
+
+    def save(self, filename):
+        np.savez(filename, bands=self.bands, fwhm=self.fwhm, offaxis=self.offaxis,
+                 radius=self.radius, modules=np.array(self.modules), area=self.area,
+                 tolerance=self.tolerance, max_error=self.max_error,
+                 source_hash=self.source_hash)
+
+    @classmethod
+    def load(cls, filename, method='linear'):
+        data = np.load(filename)
+        modules = [tuple(m) for m in data['modules']]
+        if str(data['source_hash']) != _source_hash(modules):
+            raise ValueError(filename + " was built from different effective area data, rebuild it")
+        return cls(data['bands'], data['fwhm'], data['radius'], data['offaxis'], modules=modules,
+                   tolerance=float(data['tolerance']), method=method, area=data['area'],
+                   max_error=float(data['max_error']))
+
+    def _band_index(self, energy_range):
+        match = np.nonzero(np.all(np.isclose(self.bands, energy_range), axis=1))[0]
+        return match[0] if len(match) else None
+
+    def __call__(self, energy_range=(20,30), fwhm=3, radius=9.5, offaxis=0):
+        """Average effective area (cm^2) for a Gaussian exposure, see
+        heroes_effective_area_gaussian.  fwhm, offaxis and radius may be arrays, which
+        are broadcast against each other."""
+        fwhm, offaxis, radius = np.broadcast_arrays(np.asarray(fwhm, dtype='f8'),
+                                                    np.abs(np.asarray(offaxis, dtype='f8')),
+                                                    np.asarray(radius, dtype='f8'))
+        points = np.column_stack((fwhm.ravel(), offaxis.ravel(), radius.ravel()))
+        result = np.empty(len(points))
+
+        band = self._band_index(energy_range)
+        if band is None:
+            inside = np.zeros(len(points), dtype=bool)
+        else:
+            inside = np.ones(len(points), dtype=bool)
+            for axis, grid in enumerate((self.fwhm, self.offaxis, self.radius)):
+                inside &= (points[:,axis] >= grid[0]) & (points[:,axis] <= grid[-1])
+            result[inside] = self._interpolators[band](points[inside])
+
+        for n in np.nonzero(~inside)[0]:
+            result[n] = effective_area_cubature(energy_range, points[n,2],
+                                                gaussian_weight(points[n,0], points[n,1]),
+                                                tolerance=self.tolerance, modules=self.modules)[0]
+        return result.reshape(fwhm.shape)
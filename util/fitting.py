@@ -0,0 +1,315 @@
+from __future__ import absolute_import
+
+__all__ = ["models", "model_function", "Residual", "fit_one", "batch_fit", "ThermalGridSearch"]
+
+import numpy as np
+
+from .spectra import thermal_bremsstrahlung_binned
+
+def _gaussian(p, x):
+    # p[0] is normalization
+    # p[1] is mean (first raw moment)
+    # p[2] is sigma (square root of second central moment)
+    return p[0]/np.sqrt(2.*np.pi)/p[2]*np.exp(-((x-p[1])/p[2])**2/2.)
+
+def _gaussian_jacobian(p, x):
+    z = (x - p[1]) / p[2]
+    g = np.exp(-z**2/2.)/np.sqrt(2.*np.pi)/p[2]
+    return np.column_stack((g, p[0]*g*z/p[2], p[0]*g*(z**2 - 1)/p[2]))
+
+def _linear(p, x):
+    # p[0] + p[1] x
+    return p[0] + p[1]*x
+
+def _linear_jacobian(p, x):
+    return np.column_stack((np.ones(np.shape(x)), x))
+
+def _powerlaw(p, x):
+    # p[0] x^-p[1]
+    return p[0]*x**-p[1]
+
+def _powerlaw_jacobian(p, x):
+    f = x**-p[1]
+    return np.column_stack((f, -p[0]*f*np.log(x)))
+
+def _exponential(p, x):
+    # p[0] exp(-x / p[1])
+    return p[0]*np.exp(-x/p[1])
+
+def _exponential_jacobian(p, x):
+    f = np.exp(-x/p[1])
+    return np.column_stack((f, p[0]*f*x/p[1]**2))
+
+def _gaussian_linear(p, x):
+    # gaussian line (p[0:3]) on a linear continuum (p[3:5])
+    return _gaussian(p[:3], x) + _linear(p[3:], x)
+
+def _gaussian_linear_jacobian(p, x):
+    return np.hstack((_gaussian_jacobian(p[:3], x), _linear_jacobian(p[3:], x)))
+
+# built-in models: name -> (function(p, x), jacobian(p, x) of shape (len(x), len(p)), number of parameters)
+models = {'gaussian': (_gaussian, _gaussian_jacobian, 3),
+          'linear': (_linear, _linear_jacobian, 2),
+          'powerlaw': (_powerlaw, _powerlaw_jacobian, 2),
+          'exponential': (_exponential, _exponential_jacobian, 2),
+          'gaussian_linear': (_gaussian_linear, _gaussian_linear_jacobian, 5)}
+
+def model_function(model):
+    '''Returns (function, jacobian or None) of a model given as a name in models, a
+    (function, jacobian) pair or a function f(p, x)'''
+    if isinstance(model, str):
+        if model.lower() not in models:
+            raise ValueError("Unknown model " + model + ", the built-in models are " + ", ".join(sorted(models)))
+        return models[model.lower()][:2]
+    if callable(model):
+        return model, None
+    return model
+
+class Residual(object):
+    """
+    The weighted residual (y - f(p, x)) / yerr of a model as a function of its free
+    parameters only, with the fixed ones (where free is 0) held at their initial
+    values, and its analytic Jacobian when the model has one.  One instance serves any
+    number of datasets through set_data, so nothing is rebuilt per fit.
+    """
+
+    def __init__(self, model, initial, free=None):
+        self.function, self.jacobian_function = model_function(model)
+        self.set_parameters(initial, free)
+
+    def set_parameters(self, initial, free=None):
+        self.initial = np.array(initial, dtype='f8')
+        self.free = np.ones(len(self.initial), dtype=bool) if free is None else np.asarray(free, dtype=bool)
+
+    def set_data(self, x, y, yerr=None):
+        self.x = np.asarray(x, dtype='f8')
+        self.y = np.asarray(y, dtype='f8')
+        self.yerr = np.ones(self.y.shape) if yerr is None else np.asarray(yerr, dtype='f8')
+
+    def parameters(self, p_free):
+        '''The full parameter vector for values of the free parameters'''
+        p = self.initial.copy()
+        p[self.free] = p_free
+        return p
+
+    def __call__(self, p_free):
+        return (self.y - self.function(self.parameters(p_free), self.x)) / self.yerr
+
+    def jacobian(self, p_free):
+        '''Jacobian of the residual with respect to the free parameters'''
+        jacobian = self.jacobian_function(self.parameters(p_free), self.x)[:,self.free]
+        return -jacobian / self.yerr[:,None]
+
+    def leastsq(self, **kwargs):
+        '''Run optimize.leastsq from the initial values and return its output, with the
+        full parameter vector in place of the free parameters (any covariance is that
+        of the free parameters)'''
+        from scipy import optimize
+        Dfun = self.jacobian if self.jacobian_function is not None else None
+        result = optimize.leastsq(self, self.initial[self.free], Dfun=Dfun, **kwargs)
+        return (self.parameters(result[0]),) + tuple(result[1:])
+
+def _result_dtype(n_params):
+    return np.dtype([('params', 'f8', (n_params,)), ('covariance', 'f8', (n_params, n_params)),
+                     ('chi2', 'f8'), ('dof', 'i8'), ('status', 'i4'), ('nfev', 'i4')])
+
+def _fit(residual, result, **kwargs):
+    params, covariance, info, message, status = residual.leastsq(full_output=True, **kwargs)
+    free = residual.free
+    result['params'] = params
+    result['covariance'] = 0.
+    if covariance is not None:
+        result['covariance'][np.ix_(free, free)] = covariance
+    else:
+        result['covariance'][np.ix_(free, free)] = np.nan
+    result['chi2'] = np.sum(info['fvec'] ** 2)
+    result['dof'] = len(residual.y) - np.count_nonzero(free)
+    result['status'] = status
+    result['nfev'] = info['nfev']
+
+def fit_one(x, y, model, initial, free=None, yerr=None, **kwargs):
+    """Fit one dataset, returning a record of batch_fit's result array"""
+    residual = Residual(model, initial, free)
+    residual.set_data(x, y, yerr)
+    result = np.zeros((), dtype=_result_dtype(len(residual.initial)))
+    _fit(residual, result, **kwargs)
+    return result
+
+def _fit_chunk(args):
+    model, x, y, yerr, initial, free, kwargs = args
+    residual = Residual(model, initial[0], free)
+    results = np.zeros(len(y), dtype=_result_dtype(initial.shape[1]))
+    for i in range(len(y)):
+        residual.set_parameters(initial[i], free)
+        residual.set_data(x[i] if x.ndim == 2 else x, y[i], None if yerr is None else yerr[i])
+        _fit(residual, results[i], **kwargs)
+    return results
+
+def batch_fit(x, y, model, initial, free=None, yerr=None, processes=1, chunk_size=None, **kwargs):
+    """
+    Fit a model to a stack of datasets and return a structured array with, for each
+    dataset, the fitted params, their covariance (zero for fixed parameters, nan if
+    singular), chi2, the degrees of freedom dof, the leastsq status (1 to 4 for
+    success) and the number of function evaluations nfev.
+
+    y (and yerr, if given) has shape (n_datasets, n_points) and x either the same or
+    (n_points,) when shared.  model is the name of a built-in model (see models, which
+    have analytic Jacobians), a (function, jacobian) pair or a function(p, x).
+    initial is (n_params,) or (n_datasets, n_params) and free an optional mask of the
+    parameters to fit, the others being held at their initial values.
+
+    With processes other than 1 the datasets are fitted in chunks of chunk_size on a
+    multiprocessing pool of that many processes (None for one per CPU); custom models
+    must then be picklable, i.e. module level functions.  Other keywords are passed
+    to optimize.leastsq.
+    """
+    x = np.asarray(x, dtype='f8')
+    y = np.asarray(y, dtype='f8')
+    yerr = None if yerr is None else np.asarray(yerr, dtype='f8')
+    initial = np.asarray(initial, dtype='f8')
+    if initial.ndim == 1:
+        initial = np.tile(initial, (len(y), 1))
+
+    if processes == 1:
+        return _fit_chunk((model, x, y, yerr, initial, free, kwargs))
+
+    import multiprocessing
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(y) // (4 * (processes or multiprocessing.cpu_count()))))
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunks = []
+        for start in range(0, len(y), chunk_size):
+            end = start + chunk_size
+            chunks.append((model, x[start:end] if x.ndim == 2 else x, y[start:end],
+                           None if yerr is None else yerr[start:end], initial[start:end], free, kwargs))
+        results = pool.map(_fit_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    return np.concatenate(results)
+
+class ThermalGridSearch(object):
+    """
+    Grid search of an isothermal bremsstrahlung model over temperature kt (keV) and
+    emission measure, against one or many observed count spectra, to seed fitfunc.
+
+    The model count spectrum per unit emission measure is folded through response (a
+    ResponseMatrix, whose energy bins the spectrum is integrated over, see
+    thermal_bremsstrahlung_binned) once for all temperatures.  At each temperature
+    the emission measure is then solved for: exactly for chi-square, which is
+    quadratic in it, and for the Cash statistic with vectorized Newton steps (exact
+    in one step without background).  Emission measures are limited to be >= 0.
+    """
+
+    def __init__(self, response, kt, gaunt=None, order=4):
+        self.response = response
+        self.kt = np.asarray(kt, dtype='f8')
+        flux = thermal_bremsstrahlung_binned(response.energy_edges, self.kt, emission_measure=1e49,
+                                             gaunt=gaunt, order=order)
+        # counts/s in each channel for an emission measure of 1e49 cm^-3, (n_kt, n_channels)
+        self.model = response.fold(flux)
+
+    def _dtype(self, n_em):
+        n_kt = len(self.kt)
+        fields = [('chi2', 'f8', (n_kt,)), ('cstat', 'f8', (n_kt,)),
+                  ('em_chi2', 'f8', (n_kt,)), ('em_cstat', 'f8', (n_kt,)),
+                  ('best_chi2', 'f8', (2,)), ('best_cstat', 'f8', (2,)), ('dof', 'i8')]
+        if n_em:
+            fields += [('chi2_map', 'f8', (n_kt, n_em)), ('cstat_map', 'f8', (n_kt, n_em))]
+        return np.dtype(fields)
+
+    def search(self, counts, exposure=1., background=None, counts_error=None, channels=None,
+               emission_measure=None, iterations=50, tolerance=1e-10):
+        """
+        Returns a structured array with, for each count spectrum, the chi2 and cstat
+        (Cash statistic, 2 sum(m - d + d ln(d/m))) minimized over emission measure at
+        each temperature, the emission measures em_chi2 and em_cstat (cm^-3) of those
+        minima, the (kt, emission measure) of the overall minimum of each statistic as
+        best_chi2 and best_cstat, and the dof.  If an emission_measure grid (cm^-3) is
+        given, the full maps over (kt, emission_measure) are added as chi2_map and
+        cstat_map.
+
+        counts has shape (n_channels,) or (n_spectra, n_channels) and exposure (s) is a
+        number or one per spectrum.  background is the expected background counts,
+        broadcast against counts.  counts_error defaults to sqrt(max(counts, 1)).
+        channels optionally selects the channels to use, as a mask or indices.
+        """
+        counts = np.asarray(counts, dtype='f8')
+        single = counts.ndim == 1
+        counts = np.atleast_2d(counts)
+        exposure = np.broadcast_to(np.asarray(exposure, dtype='f8'), counts.shape[:1])
+        if background is None:
+            background = np.zeros(counts.shape)
+        background = np.broadcast_to(np.asarray(background, dtype='f8'), counts.shape)
+        if counts_error is None:
+            weight = 1 / np.maximum(counts, 1)
+        else:
+            weight = 1 / np.broadcast_to(np.asarray(counts_error, dtype='f8'), counts.shape) ** 2
+        model = self.model
+        if channels is not None:
+            counts, background, weight = counts[:,channels], background[:,channels], weight[:,channels]
+            model = model[:,channels]
+
+        n_em = 0 if emission_measure is None else len(emission_measure)
+        result = np.zeros(len(counts), dtype=self._dtype(n_em))
+        result['dof'] = counts.shape[1] - 2
+
+        # chi2(a) = c - 2 a x + a^2 y for the model a exposure model + background
+        net = counts - background
+        x = (weight * net).dot(model.T) * exposure[:,None]
+        y = weight.dot((model ** 2).T) * exposure[:,None] ** 2
+        c = np.sum(weight * net ** 2, axis=1)[:,None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = np.where(y > 0, np.maximum(x / y, 0), 0)
+        result['chi2'] = c - 2 * a * x + a ** 2 * y
+        result['em_chi2'] = a * 1e49
+
+        expected = exposure[:,None,None] * model
+        a = _cash_scale(counts, background, expected, iterations, tolerance)
+        result['cstat'] = _cash(counts[:,None,:], a[:,:,None] * expected + background[:,None,:])
+        result['em_cstat'] = a * 1e49
+
+        index = np.arange(len(counts))
+        for statistic in ('chi2', 'cstat'):
+            best = np.argmin(result[statistic], axis=1)
+            result['best_' + statistic] = np.column_stack((self.kt[best], result['em_' + statistic][index, best]))
+
+        if n_em:
+            a = np.asarray(emission_measure, dtype='f8') / 1e49
+            result['chi2_map'] = c[:,:,None] - 2 * a * x[:,:,None] + a ** 2 * y[:,:,None]
+            for i in range(n_em):
+                result['cstat_map'][:,:,i] = _cash(counts[:,None,:], a[i] * expected + background[:,None,:])
+        return result[0] if single else result
+
+def _cash(counts, model):
+    '''Cash statistic summed over the last axis'''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_term = np.where(counts > 0, counts * np.log(counts / model), 0)
+    return 2 * np.sum(model - counts + log_term, axis=-1)
+
+def _cash_scale(counts, background, expected, iterations, tolerance):
+    """The scale a >= 0 of expected, shape (n_spectra, n_kt, n_channels), that
+    minimizes the Cash statistic of a expected + background, the root of
+
+        g(a) = sum(expected) - sum(counts expected / (a expected + background))
+
+    g is increasing and concave and, starting from its root without background (which
+    is at or above the root), Newton steps approach the root from below.  Steps are
+    kept above a thousandth of the previous a, so a root at 0 is reached geometrically."""
+    counts = counts[:,None,:]
+    background = background[:,None,:]
+    total = expected.sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = counts.sum(axis=2) / total
+        for i in range(iterations):
+            model = a[:,:,None] * expected + background
+            ratio = np.where(counts > 0, counts / model, 0)
+            g = total - np.sum(ratio * expected, axis=2)
+            slope = np.sum(ratio / model * expected ** 2, axis=2)
+            new = np.where(slope > 0, np.maximum(a - g / slope, a * 1e-3), a)
+            converged = not np.any(np.abs(new - a) > tolerance * a)
+            a = new
+            if converged:
+                break
+    return np.where(np.isfinite(a), a, 0)
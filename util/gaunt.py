@@ -0,0 +1,286 @@
+from __future__ import absolute_import
+
+__all__ = ["itoh_coefficients", "itoh_gaunt_factor", "GauntTable", "acgaunt",
+           "mewe_gaunt_factor"]
+
+import numpy as np
+from numpy.polynomial import polynomial
+from scipy import constants as con
+from scipy import interpolate
+
+from .datafiles import load_table
+
+# units
+temp_K_to_kev_conversion = con.k / con.e / 1000
+
+_coefficients = {}
+
+def itoh_coefficients(Z=1, relativistic=True):
+    '''Return the 11x11 coefficient array a[i,j] of the Itoh et al. (2000) fitting
+    formula.  The relativistic coefficients depend on Z (1 to 30); the non-relativistic
+    ones do not.  Each array is read once per process.'''
+
+    key = (Z, True) if relativistic else (None, False)
+    if key not in _coefficients:
+        if relativistic:
+            data = load_table('itoh.txt')
+            if not 1 <= Z <= data.shape[0]:
+                raise ValueError("Z must be between 1 and " + str(data.shape[0]))
+            _coefficients[key] = data[Z-1].reshape(11,11)
+        else:
+            _coefficients[key] = load_table('itohnr.txt')
+    return _coefficients[key]
+
+def _scaled_coordinates(log_u, kt, Z, relativistic):
+    '''Return the (temperature-like, energy-like) scaled variables of the fit'''
+    temperature_K = kt / temp_K_to_kev_conversion
+    if relativistic:
+        t = (np.log10(temperature_K) - 7.25) / 1.25
+    else:
+        g2 = Z ** 2 * 1.579e5 / temperature_K
+        t = (np.log10(g2) + 0.5) / 2.5
+    U = (log_u + 1.5) / 2.5
+    return t, U
+
+def itoh_gaunt_factor(energy_kev, kt, Z=1, relativistic=True, grid=False):
+    """Evaluate the Itoh et al. (2000) fitting formula for the thermal bremsstrahlung
+    gaunt factor
+
+        g = sum_ij a[i,j] t^i U^j
+
+    The polynomial is first collapsed over the temperature variable t, which only
+    depends on kt, and then evaluated in U by Horner's rule, so no Python loop runs
+    over the 121 terms or over the inputs.
+
+    energy_kev and kt are broadcast against each other.  With grid=True the result
+    is instead evaluated on the outer product and has shape kt.shape + energy_kev.shape,
+    e.g. (n_T, n_E) for 1D inputs.
+
+    The fit is valid for 6.0 <= log T <= 8.5 and -4 <= log u <= 1 (relativistic) or
+    -3 <= log gamma^2 <= 2 and -4 <= log u <= 1 (non-relativistic), u = E/kT.
+
+    Source
+    ======
+    Itoh et al. 2000, ApJSS, 128, 125
+    """
+    energy_kev = np.asarray(energy_kev, dtype='f8')
+    kt = np.asarray(kt, dtype='f8')
+    if grid:
+        kt = kt.reshape(kt.shape + (1,) * energy_kev.ndim)
+
+    t, U = _scaled_coordinates(np.log10(energy_kev / kt), kt, Z, relativistic)
+    coefficients = itoh_coefficients(Z, relativistic)
+
+    # a_j(t) = sum_i a[i,j] t^i has shape (11,) + t.shape
+    a = polynomial.polyval(t, coefficients)
+    return polynomial.polyval(U, a, tensor=False)
+
+class GauntTable(object):
+    """A precomputed lookup table of the Itoh gaunt factor on a regular grid in
+    (log10 kT, log10 u) covering the validity range of the fit, interpolated with a
+    bicubic spline.
+
+    The largest relative error of the table with respect to itoh_gaunt_factor is
+    measured at the cell centres, where interpolation error peaks, when the table is
+    built and is kept in max_error.  With the default 128 x 256 grid it is below 1e-6
+    for the relativistic fit (Z = 1 to 30) and below 3e-6 for the non-relativistic
+    fit.  Points outside the table are evaluated with itoh_gaunt_factor directly."""
+
+    def __init__(self, Z=1, relativistic=True, n_kt=128, n_u=256):
+        self.Z = Z
+        self.relativistic = relativistic
+
+        if relativistic:
+            log_temperature_K = (6.0, 8.5)
+        else:
+            # -3 <= log gamma^2 <= 2
+            log_temperature_K = (np.log10(Z ** 2 * 1.579e5) - 2, np.log10(Z ** 2 * 1.579e5) + 3)
+        self.log_kt_range = tuple(np.log10(10 ** np.array(log_temperature_K) * temp_K_to_kev_conversion))
+        self.log_u_range = (-4.0, 1.0)
+
+        log_kt = np.linspace(self.log_kt_range[0], self.log_kt_range[1], n_kt)
+        log_u = np.linspace(self.log_u_range[0], self.log_u_range[1], n_u)
+        self._spline = interpolate.RectBivariateSpline(log_kt, log_u, self._exact(log_kt[:,None], log_u[None,:]))
+
+        mid_kt = (log_kt[1:] + log_kt[:-1]) / 2
+        mid_u = (log_u[1:] + log_u[:-1]) / 2
+        exact = self._exact(mid_kt[:,None], mid_u[None,:])
+        self.max_error = np.max(np.abs(self._spline(mid_kt, mid_u) / exact - 1))
+
+    def _exact(self, log_kt, log_u):
+        kt = 10 ** log_kt
+        return itoh_gaunt_factor(kt * 10 ** log_u, kt, Z=self.Z, relativistic=self.relativistic)
+
+    def __call__(self, energy_kev, kt, grid=False):
+        '''Same call signature and broadcasting rules as itoh_gaunt_factor'''
+        energy_kev = np.asarray(energy_kev, dtype='f8')
+        kt = np.asarray(kt, dtype='f8')
+        if grid:
+            kt = kt.reshape(kt.shape + (1,) * energy_kev.ndim)
+        energy_kev, kt = np.broadcast_arrays(energy_kev, kt)
+
+        log_kt = np.log10(kt)
+        log_u = np.log10(energy_kev / kt)
+        inside = ((log_kt >= self.log_kt_range[0]) & (log_kt <= self.log_kt_range[1]) &
+                  (log_u >= self.log_u_range[0]) & (log_u <= self.log_u_range[1]))
+
+        result = np.empty(energy_kev.shape)
+        result[inside] = self._spline(log_kt[inside], log_u[inside], grid=False)
+        result[~inside] = itoh_gaunt_factor(energy_kev[~inside], kt[~inside], Z=self.Z,
+                                            relativistic=self.relativistic)
+        return result
+
+# Coefficients of the Mewe continuum gaunt factor approximation used by acgaunt.
+# Two-photon emission: for each edge (OVIII, OVII, NVII, NVI, CVI, CV) the
+# wavelength (Angstrom), maximum temperature (MK), normalization and exponent.
+_edge_wave = np.array([  19,   22,   25,   29,   34,   41.])
+_edge_temp = np.array([2.45,  0.9,  1.7,  0.6, 1.05, 0.37])
+_edge_cc   = np.array([ 3.2, 11.3, 0.69,  2.1,  3.6, 10.3])
+_edge_dd   = np.array([10.3,  2.5, 10.3,  2.5, 10.3,  2.5])
+
+# Free-bound emission for 0.01 <= Te_6 < 0.1 (low) and Te_6 >= 0.1 (high).  Each
+# row holds the coefficients of one wavelength bin for every temperature bin;
+# the bins are delimited by the _*_lim boundaries.
+_fb_low_tem_lim = np.array([.015, .018, .035, .07])
+_fb_low_wav_lim = np.array([227.9, 504.3, 911.9])
+
+_fb_low_a = np.array([[ .248, 5.42e-12, 3.68e-4, 1.86e+3, 6.5e-3],
+                      [ .248, 5.42e-12, 3.68e-4,    .176,   .176],
+                      [ .248, 5.42e-12,    .323,    .323,   .323],
+                      [.0535,    .0535,   .0535,   .0535,  .0535]])
+_fb_low_b = np.array([[-1., -9.39, -4.9, -.686, -5.41],
+                      [-1., -9.39, -4.9,   -1.,   -1.],
+                      [-1., -9.39,  -1.,   -1.,   -1.],
+                      [-1.,   -1.,  -1.,   -1.,   -1.]])
+_fb_low_c = np.array([[.158,  0.0,  0.0,  0.0,  0.0],
+                      [.158,  0.0,  0.0, .233, .233],
+                      [.158,  0.0,  .16,  .16,  .16],
+                      [.046, .046, .046, .046, .046]])
+_fb_low_d = np.array([[-1., 0.0, 0.0, 0.0, 0.0],
+                      [-1., 0.0, 0.0, -1., -1.],
+                      [-1., 0.0, -1., -1., -1.],
+                      [-1., -1., -1., -1., -1.]])
+
+_fb_high_tem_lim = np.array([.2, .258, .4, .585, 1., 1.5, 3., 4.5, 8.])
+_fb_high_wav_lim = np.array([1.4, 4.6, 6.1, 9.1, 14.2, 16.8, 18.6, 22.5, 25.3, 31.6,
+                             51.9, 57.0, 89.8, 227.9, 911.9])
+
+_fb_high_a = np.array([[0.68, 3.73, 5.33, 14.0, 49.0, 49.0, 49.0,  4.2,  4.2,  4.2],
+                       [0.68, 3.73, 5.33, 14.0, 49.0, 49.0, 49.0,  4.2,  4.2, 18.4],
+                       [0.68, 3.73, 5.33, 14.0, 49.0, 49.0, 49.0, 5.08, 5.08, 18.4],
+                       [0.68, 3.73, 5.33, 14.0, 49.0, 49.0, 49.0, 3.75, 3.75, 3.75],
+                       [0.68, 3.73, 5.33, 14.0, 49.0, 22.4, 22.4, 2.12, 2.12, 2.12],
+                       [0.68, 3.73, 5.33, 14.0, 49.0, 22.4, 46.3, 46.3, 6.12, 6.12],
+                       [0.68, 3.73, 5.33, 14.0, 12.3, 12.3, 12.3, 12.3, 6.12, 6.12],
+                       [0.68, 3.73, 5.33, 14.0, 12.3, 12.3, 10.2, 10.2, 4.98, 4.98],
+                       [0.68, 3.73, 5.33, 10.2, 10.2, 10.2, 10.2, 10.2, 4.98, 4.98],
+                       [0.68, 3.73, 5.33, 10.2,  3.9,  3.9, 2.04, 2.04,  1.1,  1.1],
+                       [0.68, 3.73, .653, 1.04, 1.04, 1.04, 1.04, 1.04, 1.04, 1.04],
+                       [0.68, 3.73, .653, .653, .653, .653, 1.04, 1.04, 1.04, 1.04],
+                       [0.68, 3.73, .653, .653, .653, .653, .653, .653, .653, .653],
+                       [0.6] * 10,
+                       [.37] * 10,
+                       [.053] * 10])
+_fb_high_b = np.array([[-1., -1., -1.595, -.543, -1.572, -1.572, -1.572,  -.82,   -.82,   -.82],
+                       [-1., -1., -1.595, -.543, -1.572, -1.572, -1.572,  -.82,   -.82,  -1.33],
+                       [-1., -1., -1.595, -.543, -1.572, -1.572, -1.572,   -1.,    -1.,  -1.33],
+                       [-1., -1., -1.595, -.543, -1.572, -1.572, -1.572,   -1.,    -1.,    -1.],
+                       [-1., -1., -1.595, -.543, -1.572,   -1.2,   -1.2,   -1.,    -1.,    -1.],
+                       [-1., -1., -1.595, -.543, -1.572,   -1.2,  -3.06, -3.06, -1.556, -1.556],
+                       [-1., -1., -1.595, -.543,  -2.09,  -2.09,  -2.09, -2.09, -1.556, -1.556],
+                       [-1., -1., -1.595, -.543,  -2.09,  -2.09,  -2.19, -2.19, -1.556, -1.556],
+                       [-1., -1., -1.595, -2.19,  -2.19,  -2.19,  -2.19, -2.19, -1.556, -1.556],
+                       [-1., -1., -1.595, -2.19, -2.763, -2.763,  -1.31, -1.31,    -1.,    -1.]]
+                      + [[-1.] * 10] * 6)
+_fb_high_c = np.array([[0.55, 0.21, 0.0,   0.0, -.826, -.826, -.826,   4.,  4.,  4.],
+                       [0.55, 0.21, 0.0,   0.0, -.826, -.826, -.826,   4.,  4., 0.0],
+                       [0.55, 0.21, 0.0,   0.0, -.826, -.826, -.826,  3.9, 3.9, 0.0],
+                       [0.55, 0.21, 0.0,   0.0, -.826, -.826, -.826,  4.2, 4.2, 4.2],
+                       [0.55, 0.21, 0.0,   0.0, -.826,   0.0,   0.0,  5.6, 5.6, 5.6],
+                       [0.55, 0.21, 0.0,   0.0, -.826,   0.0,   0.0,  0.0, 0.0, 0.0],
+                       [0.55, 0.21, 0.0,   0.0, -.208, -.208, -.208, -.208, 0.0, 0.0],
+                       [0.55, 0.21, 0.0,   0.0, -.208, -.208, -.208, -.208, 0.0, 0.0],
+                       [0.55, 0.21, 0.0, -.208, -.208, -.208, -.208, -.208, 0.0, 0.0],
+                       [0.55, 0.21, 0.0, -.208,   0.0,   0.0,   0.0,   0.0, .58, .58],
+                       [0.55, 0.21, .72,   .58,   .58,   .58,   .58,   .58, .58, .58],
+                       [0.55, 0.21, .72,   .72,   .72,   .72,   .58,   .58, .58, .58],
+                       [0.55, 0.21, .72,   .72,   .72,   .72,   .72,   .72, .72, .72],
+                       [.55] * 10,
+                       [.158] * 10,
+                       [.05] * 10])
+_fb_high_d = np.array([[-1., -1., 0.0, 0.0, -1., -1., -1., -1., -1., -1.],
+                       [-1., -1., 0.0, 0.0, -1., -1., -1., -1., -1., 0.0],
+                       [-1., -1., 0.0, 0.0, -1., -1., -1., -1., -1., 0.0],
+                       [-1., -1., 0.0, 0.0, -1., -1., -1., -1., -1., -1.],
+                       [-1., -1., 0.0, 0.0, -1., 0.0, 0.0, -1., -1., -1.],
+                       [-1., -1., 0.0, 0.0, -1., 0.0, 0.0, 0.0, 0.0, 0.0],
+                       [-1., -1., 0.0, 0.0, -2., -2., -2., -2., 0.0, 0.0],
+                       [-1., -1., 0.0, 0.0, -2., -2., -2., -2., 0.0, 0.0],
+                       [-1., -1., 0.0, -2., -2., -2., -2., -2., 0.0, 0.0],
+                       [-1., -1., 0.0, -2., 0.0, 0.0, 0.0, 0.0, -1., -1.]]
+                      + [[-1.] * 10] * 6)
+
+def _free_bound(wave, te_6, tem_lim, wav_lim, a, b, c, d):
+    # bin lookups, equivalent to IDL indd: lim[k-1] < x <= lim[k] -> k
+    i = np.searchsorted(tem_lim, te_6)
+    j = np.searchsorted(wav_lim, wave)
+    return a[j,i] * te_6 ** b[j,i] * np.exp(c[j,i] * te_6 ** d[j,i])
+
+def _acgaunt(wave, te_6):
+    '''acgaunt on inputs that are already broadcast against each other'''
+
+    # Free-free gaunt factor
+    # (good for 1.e4 < te_6*1.e6 < 1.e9 K; 1 < wave < 1000 Ang)
+    gaunt_ff = np.where(te_6 <= 1,
+                        0.29 * wave ** (0.48 * wave ** (-0.08)) * te_6 ** (0.133 * np.log10(wave) - 0.2),
+                        1.01 * wave ** (0.355 * wave ** (-0.06)) * (te_6 / 100.) ** (0.3 * wave ** (-0.066)))
+
+    # Two-photon gaunt factor, summed over the edges on a trailing axis
+    wv = wave[...,None]
+    te = te_6[...,None]
+    alpha = 106. / (_edge_wave * te ** (-0.94))
+    # only wavelengths longward of an edge contribute, the ratio is capped at 1
+    # so that the masked terms cannot overflow
+    ratio = np.minimum(_edge_wave / wv, 1.)
+    gaunt_2p = ((wv > _edge_wave) * _edge_cc * ratio ** alpha *
+                np.sqrt(np.abs(np.cos(np.pi * (ratio - 0.5)))) *
+                (_edge_temp / te) ** 0.45 *
+                10. ** np.maximum(-_edge_dd * np.log10(te / _edge_temp) ** 2, -37)).sum(axis=-1)
+    gaunt_2p *= (wave > 19.) & (wave <= 200.)
+
+    # Free-bound gaunt factor, zero below 0.01 MK; each case is evaluated with the
+    # temperature clipped to its own range so that the other cases do not overflow
+    gaunt_fb_low = _free_bound(wave, np.clip(te_6, 0.01, 0.1), _fb_low_tem_lim, _fb_low_wav_lim,
+                               _fb_low_a, _fb_low_b, _fb_low_c, _fb_low_d)
+    gaunt_fb_high = _free_bound(wave, np.maximum(te_6, 0.1), _fb_high_tem_lim, _fb_high_wav_lim,
+                                _fb_high_a, _fb_high_b, _fb_high_c, _fb_high_d)
+    gaunt_fb = np.where(te_6 < 0.01, 0., np.where(te_6 < 0.1, gaunt_fb_low, gaunt_fb_high))
+
+    return gaunt_ff + gaunt_2p + gaunt_fb
+
+def acgaunt(wave, te_6):
+    """Calculate continuum gaunt factor using approximations of R. Mewe (18-JUN-85) to 
+    full calculations of paper VI (Arnaut and Rothenflug for ion balances).
+
+    wave is the wavelength in Angstrom and te_6 the temperature in MK.  Like the IDL
+    routine the result is the sum of the free-free, two-photon and free-bound terms
+    evaluated for every pair of inputs, with shape te_6.shape + wave.shape.
+    """
+    wave = np.asarray(wave, dtype='f8')
+    te_6 = np.asarray(te_6, dtype='f8')
+
+    wave, te_6 = np.broadcast_arrays(wave.reshape((1,) * te_6.ndim + wave.shape),
+                                     te_6.reshape(te_6.shape + (1,) * wave.ndim))
+    return _acgaunt(wave, te_6)
+
+def mewe_gaunt_factor(energy_kev, kt, grid=False):
+    '''acgaunt with the arguments in keV, as used by the IDL brem_49.  energy_kev and kt
+    are broadcast against each other, or with grid=True evaluated on their outer
+    product (shape kt.shape + energy_kev.shape).'''
+    energy_kev = np.asarray(energy_kev, dtype='f8')
+    kt = np.asarray(kt, dtype='f8')
+    if grid:
+        kt = kt.reshape(kt.shape + (1,) * energy_kev.ndim)
+
+    wave, te_6 = np.broadcast_arrays(12.3985 / energy_kev, kt / .08617)
+    return _acgaunt(wave, te_6)
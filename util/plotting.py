@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+
+__all__ = ["downsample", "new_figure", "save_figure", "draw_curves", "render_curves",
+           "show_curves"]
+
+import numpy as np
+
+def downsample(x, y, max_points=2000):
+    '''Reduce a curve to at most about max_points points for plotting, keeping the
+    first and last point and the minimum and maximum of y in each of max_points / 2
+    buckets, so that peaks and edges survive.  x must be sorted.'''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) <= max_points:
+        return x, y
+
+    size = -(-len(y) // max(max_points // 2, 1))
+    full = len(y) // size * size
+    blocks = y[:full].reshape(-1, size)
+    offsets = np.arange(0, full, size)
+    keep = [[0, len(y) - 1], offsets + blocks.argmin(axis=1), offsets + blocks.argmax(axis=1)]
+    if full < len(y):
+        keep.append([full + y[full:].argmin(), full + y[full:].argmax()])
+    keep = np.unique(np.concatenate(keep))
+    return x[keep], y[keep]
+
+def new_figure(figsize=(8, 6), dpi=100):
+    '''Returns a matplotlib Figure drawn by the Agg backend, without pyplot, so that any
+    number of figures can be made and saved in one process with no display and no
+    global state.  It is freed as soon as it is no longer referenced.'''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(figure)
+    return figure
+
+def save_figure(figure, filename, **kwargs):
+    '''Write a figure to a file, the format is given by the extension (png, pdf, svg...)'''
+    figure.savefig(filename, **kwargs)
+
+def draw_curves(ax, curves, xtitle=None, ytitle=None, title=None, log=None, legend=None,
+                max_points=2000):
+    """
+    Draw precomputed curves on a matplotlib Axes.
+
+    curves is a sequence of (x, y) or (x, y, style) where style is a dict of keywords
+    for ax.plot (e.g. {'color': 'red', 'linestyle': '', 'marker': 'o'}).  Curves longer
+    than max_points are downsampled (None to disable).  log is [x, y] with 1 for a
+    log axis, as in Fit_data.
+    """
+    if log is not None:
+        if log[0] == 1:
+            ax.set_xscale('log')
+        if log[1] == 1:
+            ax.set_yscale('log')
+
+    if ytitle is not None:
+        ax.set_ylabel(ytitle)
+    if xtitle is not None:
+        ax.set_xlabel(xtitle)
+    if title is not None:
+        ax.set_title(title)
+
+    for curve in curves:
+        x, y = curve[0], curve[1]
+        style = curve[2] if len(curve) > 2 else {}
+        if max_points is not None:
+            x, y = downsample(x, y, max_points)
+        ax.plot(x, y, **style)
+
+    if legend is not None:
+        ax.legend(legend)
+    return ax
+
+def render_curves(filename, curves, figsize=(8, 6), dpi=100, **kwargs):
+    '''Draw curves (see draw_curves for the other keywords) on a new Agg figure and
+    save it to filename.  This is the batch path: no pyplot, no display.'''
+    figure = new_figure(figsize=figsize, dpi=dpi)
+    draw_curves(figure.add_subplot(111), curves, **kwargs)
+    save_figure(figure, filename)
+    return figure
+
+def show_curves(curves, **kwargs):
+    '''Draw curves (see draw_curves) in an interactive pyplot window'''
+    import matplotlib.pyplot as plt
+    draw_curves(plt.subplot(111), curves, **kwargs)
+    plt.show()
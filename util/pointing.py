@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+
+__all__ = ["PointingProfile", "load_pointing_profiles", "pointing_profile"]
+
+import os
+import io
+import glob
+
+import numpy as np
+from scipy import interpolate
+
+from .datafiles import data_dir, load_table, _read_table
+
+_profiles = {}
+
+class PointingProfile(object):
+    """
+    The distribution of pointing offsets of a target, from its cumulative exposure
+    fraction tabulated against offset (arcmin).
+
+    The cumulative distribution is fitted with a monotone (PCHIP) cubic through
+    (0, 0) and the data, so the density is its exact derivative and is never
+    negative.  Beyond the last tabulated offset the density is zero.
+    """
+
+    def __init__(self, offset_arcmin, cumulative, name=''):
+        offset_arcmin = np.asarray(offset_arcmin, dtype='f8')
+        cumulative = np.asarray(cumulative, dtype='f8')
+        if offset_arcmin[0] > 0:
+            offset_arcmin = np.concatenate(([0.], offset_arcmin))
+            cumulative = np.concatenate(([0.], cumulative))
+
+        self.name = name
+        self.offset_arcmin = offset_arcmin
+        self._cumulative = interpolate.PchipInterpolator(offset_arcmin, cumulative, extrapolate=False)
+        self._density = self._cumulative.derivative()
+
+    @property
+    def breaks(self):
+        '''Offsets at which the density is not smooth, for effective_area_cubature'''
+        return self.offset_arcmin
+
+    def cumulative(self, offset_arcmin):
+        offset_arcmin = np.asarray(offset_arcmin, dtype='f8')
+        result = self._cumulative(np.minimum(offset_arcmin, self.offset_arcmin[-1]))
+        return np.where(offset_arcmin < 0, 0., result)
+
+    def density(self, offset_arcmin):
+        '''Exposure fraction per arcmin of offset, vectorized'''
+        result = self._density(offset_arcmin)
+        return np.where(np.isnan(result), 0., result)
+
+    __call__ = density
+
+def load_pointing_profiles(filename):
+    """
+    Read a pointing file in the format of hero2011_pointing*.txt and return a dict of
+    PointingProfile by target name.  Profiles are built once per file.
+
+    The first column is the offset in arcmin.  If the first line is a header
+    (e.g. "arcmin grs1915 all") every other column is the cumulative exposure
+    fraction of the target it names.  Otherwise the second column is the
+    cumulative fraction of a single target named by the end of the file name
+    (hero2011_pointing_cena.txt -> 'cena') and further columns are ignored.
+    """
+    filename = os.path.join(data_dir, filename)
+    if filename not in _profiles:
+        with io.open(filename, encoding='latin-1') as fp:
+            header = fp.readline().split()
+        name = os.path.basename(filename)
+        try:
+            float(header[0])
+            stem = os.path.splitext(name)[0]
+            names = [stem.split('pointing_')[-1]]
+        except ValueError:
+            names = header[1:]
+
+        if os.path.join(data_dir, name) == filename:
+            data = load_table(name)
+        else:
+            data = _read_table(filename)
+        _profiles[filename] = dict((target, PointingProfile(data[:,0], data[:,i+1], name=target))
+                                   for i, target in enumerate(names))
+    return _profiles[filename]
+
+def pointing_profile(target, filename=None):
+    '''Return the PointingProfile of a target (e.g. 'grs1915', 'all' or 'cena'), taken
+    from filename or else from the first pointing file in data_dir that has it.'''
+
+    if filename is not None:
+        filenames = [filename]
+    else:
+        filenames = sorted(glob.glob(os.path.join(data_dir, '*pointing*.txt')))
+    for filename in filenames:
+        profiles = load_pointing_profiles(filename)
+        if target in profiles:
+            return profiles[target]
+    raise ValueError("Invalid target for actual pointing data")
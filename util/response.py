@@ -0,0 +1,215 @@
+from __future__ import absolute_import
+
+__all__ = ["ResponseMatrix", "response_matrix"]
+
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+from scipy import sparse
+from scipy import special
+
+from .effective_area import heroes_effective_area, _modules_key, _source_hash, _composite_rule
+from .atmosphere import flight_track_transmission
+from .detector import detector_response
+
+class ResponseMatrix(object):
+    """
+    The HEROES response as a sparse matrix from photon energy bins to count channels,
+    in the manner of an OGIP RMF x ARF.
+
+    The ancillary response of a photon of energy e is
+
+        arf(e) = A(e, offaxis_arcmin) T(e) D(e)
+
+    with A the off-axis effective area spline (cm^2, for modules), T the atmospheric
+    transmission at altitude_km looking up at elevation_deg through column_mass (a
+    ColumnMassTable, or no atmosphere if None) and D the detector efficiency of a
+    detector of detector_thickness_um behind a stack of filters, as (material,
+    thickness_um) pairs (see detector_response; no detector if detector is None).
+
+    Each photon bin is sampled with an order-point Gauss-Legendre rule and every
+    sample is redistributed into the channels with a Gaussian of fwhm_kev (a number
+    or a function of energy), or into the channel that contains it if fwhm_kev is
+    None.  Entries below threshold times the largest one are dropped.  The matrix is
+    built on first use, a block of bins at a time straight into sparse form, so its
+    memory grows with the number of entries kept rather than n_channels x n_bins.
+
+    matrix[j, i] is the count rate (counts/s) in channel j per unit photon flux
+    (photons s^-1 cm^-2) in bin i, spread uniformly over the bin, and arf[i] the bin
+    average of arf(e).
+    """
+
+    def __init__(self, energy_edges_kev, channel_edges_kev=None, offaxis_arcmin=0, modules=None,
+                 altitude_km=None, elevation_deg=90, column_mass=None,
+                 detector='cadmium telluride', detector_thickness_um=None, filters=(),
+                 fwhm_kev=None, order=4, threshold=1e-8, matrix=None, arf=None):
+        self.energy_edges = np.asarray(energy_edges_kev, dtype='f8')
+        if channel_edges_kev is None:
+            channel_edges_kev = energy_edges_kev
+        self.channel_edges = np.asarray(channel_edges_kev, dtype='f8')
+        self.offaxis_arcmin = offaxis_arcmin
+        self.modules = _modules_key(modules)
+        self.altitude_km = altitude_km
+        self.elevation_deg = elevation_deg
+        self.column_mass = column_mass
+        self.detector = detector
+        self.detector_thickness_um = detector_thickness_um
+        self.filters = tuple((material, float(thickness)) for material, thickness in filters)
+        self.fwhm_kev = fwhm_kev
+        self.order = order
+        self.threshold = threshold
+        self._matrix = matrix
+        self._arf = arf
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix, self._arf = self._build()
+        return self._matrix
+
+    @property
+    def arf(self):
+        if self._arf is None:
+            self._matrix, self._arf = self._build()
+        return self._arf
+
+    def ancillary_response(self, energy_kev):
+        '''arf(e) (cm^2) at an array of energies in keV'''
+        energy_kev = np.asarray(energy_kev, dtype='f8')
+        response = heroes_effective_area(energy_kev, self.offaxis_arcmin, modules=self.modules)
+        if self.column_mass is not None:
+            response = response * flight_track_transmission([self.altitude_km], [self.elevation_deg],
+                                                            energy_kev, self.column_mass)[0][0].reshape(energy_kev.shape)
+        if self.detector is not None and self.detector_thickness_um is not None:
+            materials = [material for material, thickness in self.filters]
+            thickness_um = [thickness for material, thickness in self.filters]
+            response = response * detector_response(energy_kev, self.detector_thickness_um, self.detector,
+                                                    materials=materials, thickness_um=thickness_um)
+        return response
+
+    def _redistribution(self, energy_kev):
+        '''First channel and probability of detection in it and the following channels
+        for photons of each energy, shape (n, len(energy_kev)).  Only the channels the
+        energies fall in, or within 8 sigma of them, are included.'''
+        n_channels = len(self.channel_edges) - 1
+        if self.fwhm_kev is None:
+            channel = np.searchsorted(self.channel_edges, energy_kev, side='right') - 1
+            inside = np.nonzero((channel >= 0) & (channel < n_channels))[0]
+            if len(inside) == 0:
+                return 0, np.zeros((0, len(energy_kev)))
+            first = channel[inside].min()
+            probability = np.zeros((channel[inside].max() + 1 - first, len(energy_kev)))
+            probability[channel[inside] - first, inside] = 1.
+            return first, probability
+
+        fwhm = self.fwhm_kev(energy_kev) if callable(self.fwhm_kev) else self.fwhm_kev
+        sigma = np.broadcast_to(np.asarray(fwhm, dtype='f8') / 2.355, energy_kev.shape)
+        first = max(np.searchsorted(self.channel_edges, np.min(energy_kev - 8 * sigma), side='right') - 1, 0)
+        last = min(np.searchsorted(self.channel_edges, np.max(energy_kev + 8 * sigma)), n_channels)
+        cumulative = special.ndtr((self.channel_edges[first:max(last, first) + 1,None] - energy_kev) / sigma)
+        return first, cumulative[1:] - cumulative[:-1]
+
+    def _build(self, block=256):
+        edges = self.energy_edges
+        width = edges[1:] - edges[:-1]
+        n_channels = len(self.channel_edges) - 1
+        # order nodes in each bin, row by row
+        energy, weights = _composite_rule(edges[0], edges[-1], edges, self.order)
+        weights = weights / np.repeat(width, self.order) * self.ancillary_response(energy)
+        arf = weights.reshape(len(width), self.order).sum(axis=1)
+
+        # blocks of bins are thresholded against the largest entry so far as they are
+        # built, and the whole matrix against the largest entry at the end
+        columns = []
+        largest = 0.
+        for start in range(0, len(width), block):
+            stop = min(start + block, len(width))
+            nodes = slice(start * self.order, stop * self.order)
+            first, probability = self._redistribution(energy[nodes])
+            probability = probability * weights[nodes]
+            probability = probability.reshape(-1, stop - start, self.order).sum(axis=2)
+            if probability.size:
+                largest = max(largest, probability.max())
+            channel, column = np.nonzero(probability >= self.threshold * largest)
+            columns.append(sparse.csr_matrix((probability[channel, column], (channel + first, column)),
+                                             shape=(n_channels, stop - start)))
+
+        matrix = sparse.hstack(columns, format='csr')
+        matrix.data[matrix.data < self.threshold * largest] = 0
+        matrix.eliminate_zeros()
+        return matrix, arf
+
+    def fold(self, photon_flux):
+        """Count rate (counts/s) in each channel for photon fluxes (photons s^-1 cm^-2)
+        integrated over each energy bin, of shape (n_bins,) or (n_spectra, n_bins) for a
+        batch of model spectra, which are folded with one sparse matrix product."""
+        photon_flux = np.asarray(photon_flux, dtype='f8')
+        counts = self.matrix.dot(photon_flux.reshape(-1, photon_flux.shape[-1]).T).T
+        return counts.reshape(photon_flux.shape[:-1] + (self.matrix.shape[0],))
+
+    def key(self):
+        '''sha1 of everything the response depends on, including the effective area and
+        atmosphere data.  A fwhm_kev function is identified by its values at the energy
+        bin edges.'''
+        sha1 = hashlib.sha1()
+        for array in (self.energy_edges, self.channel_edges):
+            sha1.update(np.ascontiguousarray(array).tobytes())
+        fwhm_kev = self.fwhm_kev
+        if callable(fwhm_kev):
+            fwhm_kev = self.fwhm_kev(self.energy_edges)
+        sha1.update(repr((float(self.offaxis_arcmin), self.altitude_km, self.elevation_deg,
+                          self.detector, self.detector_thickness_um, self.filters, self.order,
+                          self.threshold)).encode('ascii'))
+        sha1.update(np.asarray(fwhm_kev if fwhm_kev is not None else np.nan, dtype='f8').tobytes())
+        sha1.update(_source_hash(self.modules).encode('ascii'))
+        if self.column_mass is not None:
+            sha1.update(self.column_mass.height_km.tobytes())
+            sha1.update(self.column_mass.column.tobytes())
+        return sha1.hexdigest()
+
+    def save(self, filename):
+        matrix = self.matrix.tocsr()
+        np.savez(filename, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                 shape=matrix.shape, arf=self.arf, energy_edges=self.energy_edges,
+                 channel_edges=self.channel_edges, key=self.key())
+
+    @classmethod
+    def load(cls, filename, **kwargs):
+        '''Load a saved response.  The other arguments are those of the response, which
+        are checked against the key it was saved with.'''
+        data = np.load(filename)
+        matrix = sparse.csr_matrix((data['data'], data['indices'], data['indptr']),
+                                   shape=tuple(data['shape']))
+        kwargs.setdefault('channel_edges_kev', data['channel_edges'])
+        response = cls(data['energy_edges'], matrix=matrix, arf=data['arf'], **kwargs)
+        if str(data['key']) != response.key():
+            raise ValueError(filename + " was built for a different response, rebuild it")
+        return response
+
+def response_matrix(energy_edges_kev, directory=None, **kwargs):
+    """
+    Return the ResponseMatrix for energy_edges_kev and the other arguments of
+    ResponseMatrix, reading it from the on-disk cache in directory if it has been
+    built before (by any process) and building and saving it otherwise.
+
+    directory defaults to $HEROES_RESPONSE_CACHE or ~/.heroes/response
+    """
+    if directory is None:
+        directory = os.environ.get('HEROES_RESPONSE_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.heroes', 'response'))
+    response = ResponseMatrix(energy_edges_kev, **kwargs)
+    filename = os.path.join(directory, response.key() + '.npz')
+
+    if os.path.exists(filename):
+        return ResponseMatrix.load(filename, **kwargs)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.npz')
+    with os.fdopen(fd, 'wb') as fp:
+        response.save(fp)
+    os.chmod(temp_name, 0o644)
+    os.rename(temp_name, filename)
+    return response
@@ -0,0 +1,249 @@
+from __future__ import absolute_import
+
+__all__ = ["event_dtype", "PhotonSimulator", "simulate_events"]
+
+import warnings
+
+import numpy as np
+
+from .effective_area import heroes_effective_area, _composite_rule, tophat_weight, gaussian_weight
+from .atmosphere import flight_track_transmission
+from .detector import detector_response
+from .util import detector_background
+
+# time since the start of the observation (s), energy (keV), off-axis angle (arcmin,
+# nan for background) and whether the event is background
+event_dtype = np.dtype([('time', 'f8'), ('energy', 'f4'), ('offaxis', 'f4'), ('background', '?')])
+
+class PhotonSimulator(object):
+    """
+    Monte Carlo simulation of a HEROES observation of a source as an event list.
+
+    spectrum is the photon flux of the source (photons s^-1 cm^-2 keV^-1) as a
+    vectorized function of energy (keV), e.g. functools.partial(thermal_bremsstrahlung_thin,
+    kt=2.), observed for exposure seconds between energy_range (keV).  The off-axis
+    angle (arcmin) of each photon is offaxis, or drawn from a circular Gaussian of
+    fwhm arcmin centred offaxis arcmin from the axis if fwhm is given, uniformly over
+    a disc of radius arcmin if radius is given or from a PointingProfile if profile is
+    given.
+
+    Photons are thinned by the effective area spline (for modules), the atmospheric
+    transmission at altitude_km looking up at elevation_deg through column_mass (a
+    ColumnMassTable, or no atmosphere if None) and the efficiency of a detector of
+    detector_thickness_um behind filters, (material, thickness_um) pairs (no detector
+    if detector_thickness_um is None).  Background events are drawn from background,
+    a rate (counts s^-1 keV^-1 cm^-2) as a function of energy, by default
+    detector_background, over background_area cm^2.
+
+    The spectrum times the transmission and detector efficiency is tabulated every
+    step_kev and interpolated linearly, which is accurate to about 1e-6 for thermal
+    spectra with the default step.  Source events are sampled by rejection from a
+    piecewise constant envelope on that grid, so each costs about one effective area
+    evaluation.  The expected number of source events, rate * exposure, is
+    integrated with Gauss-Legendre rules.
+    """
+
+    def __init__(self, spectrum, exposure, energy_range=(20, 80), offaxis=0., fwhm=None, radius=None,
+                 profile=None, modules=None, altitude_km=None, elevation_deg=90, column_mass=None,
+                 detector='cadmium telluride', detector_thickness_um=None, filters=(),
+                 background=None, background_area=8 * 0.04, step_kev=0.01, order=8):
+        self.spectrum = spectrum
+        self.exposure = float(exposure)
+        self.energy_range = (float(energy_range[0]), float(energy_range[1]))
+        self.offaxis = float(offaxis)
+        self.fwhm = fwhm
+        self.radius = radius
+        self.profile = profile
+        self.modules = modules
+        self.background = detector_background if background is None else background
+        self.background_area = background_area
+
+        low, high = self.energy_range
+        n_cells = max(1, int(np.ceil((high - low) / step_kev)))
+        self.energy_grid = np.linspace(low, high, n_cells + 1)
+        self._width = np.diff(self.energy_grid)
+
+        # spectrum x transmission x detector efficiency on the grid
+        detected = self.spectrum(self.energy_grid)
+        if column_mass is not None:
+            detected = detected * flight_track_transmission([altitude_km], [elevation_deg],
+                                                            self.energy_grid, column_mass)[0][0]
+        if detector_thickness_um is not None:
+            detected = detected * detector_response(self.energy_grid, detector_thickness_um, detector,
+                                                    materials=[m for m, t in filters],
+                                                    thickness_um=[t for m, t in filters])
+        self.detected = detected
+
+        if profile is not None:
+            self._profile_offset = np.linspace(0, profile.breaks[-1], 4097)
+            self._profile_cumulative = profile.cumulative(self._profile_offset)
+
+        offaxis_nodes, offaxis_weights = self._offaxis_rule(order)
+        # envelope of the linear interpolation of detected times the effective area in
+        # each cell, with the largest area over the off-axis angles at the left, middle
+        # and right of the cell
+        offaxis = offaxis_nodes
+        if offaxis_nodes.size > 1:
+            offaxis = np.union1d(np.linspace(0, offaxis_nodes[-1], 129), offaxis_nodes)
+        middle = (self.energy_grid[1:] + self.energy_grid[:-1]) / 2
+        points = np.concatenate((self.energy_grid, middle))
+        largest_area = np.max(heroes_effective_area(points[:,None], offaxis, modules=modules), axis=1)
+        largest_area = np.max([largest_area[:n_cells], largest_area[1:n_cells + 1], largest_area[n_cells + 1:]], axis=0)
+        self.envelope = 1.02 * np.maximum(detected[:-1], detected[1:]) * largest_area
+        cumulative = np.cumsum(self.envelope * np.diff(self.energy_grid))
+        self._cumulative = cumulative / cumulative[-1]
+
+        # source and background rates (counts/s), with a 2 point Gauss-Legendre rule per cell
+        energy, weights = _composite_rule(low, high, self.energy_grid, 2)
+        average_area = heroes_effective_area(energy[:,None], offaxis_nodes, modules=modules).dot(offaxis_weights)
+        self.rate = np.sum(weights * np.interp(energy, self.energy_grid, detected) * average_area)
+        self.background_rate = np.sum(weights * self.background(energy)) * self.background_area
+        self._background_max = 1.02 * np.max(self.background(points))
+
+    def _offaxis_rule(self, order):
+        '''Nodes and weights in off-axis angle of the exposure distribution'''
+        if self.profile is not None:
+            breaks = self.profile.breaks
+            return _composite_rule(0, breaks[-1], breaks, order)
+        if self.fwhm is not None:
+            sigma = self.fwhm / 2.355
+            offaxis, weights = _composite_rule(0, abs(self.offaxis) + 8 * sigma,
+                                               [abs(self.offaxis)], order)
+            return offaxis, weights * gaussian_weight(self.fwhm, self.offaxis)(offaxis)
+        if self.radius is not None:
+            offaxis, weights = _composite_rule(0, self.radius, (), order)
+            return offaxis, weights * tophat_weight(self.radius)(offaxis)
+        return np.array([self.offaxis]), np.array([1.])
+
+    def sample_offaxis(self, rng, n):
+        '''n off-axis angles (arcmin) from the exposure distribution'''
+        if self.profile is not None:
+            cumulative = self._profile_cumulative
+            return np.interp(rng.uniform(0, cumulative[-1], n), cumulative, self._profile_offset)
+        if self.fwhm is not None:
+            sigma = self.fwhm / 2.355
+            return np.hypot(self.offaxis + sigma * rng.standard_normal(n), sigma * rng.standard_normal(n))
+        if self.radius is not None:
+            return self.radius * np.sqrt(rng.uniform(size=n))
+        return np.full(n, self.offaxis)
+
+    def sample_source(self, rng, n):
+        '''Energies (keV) and off-axis angles (arcmin) of n detected source photons,
+        and the number of proposals whose acceptance had to be clipped at 1'''
+        energy, offaxis = np.empty(n), np.empty(n)
+        filled = clipped = 0
+        acceptance = 0.5
+        while filled < n:
+            m = int((n - filled) / acceptance * 1.1) + 16
+            cell = np.searchsorted(self._cumulative, rng.uniform(size=m))
+            fraction = rng.uniform(size=m)
+            proposed = self.energy_grid[cell] + self._width[cell] * fraction
+            angle = self.sample_offaxis(rng, m)
+            detected = self.detected[cell] + (self.detected[cell + 1] - self.detected[cell]) * fraction
+            ratio = detected * heroes_effective_area(proposed, angle, modules=self.modules) / self.envelope[cell]
+            clipped += np.count_nonzero(ratio > 1)
+            accepted = np.nonzero(rng.uniform(size=m) < ratio)[0]
+            acceptance = max(len(accepted) / float(m), 1e-3)
+            accepted = accepted[:n - filled]
+            energy[filled:filled + len(accepted)] = proposed[accepted]
+            offaxis[filled:filled + len(accepted)] = angle[accepted]
+            filled += len(accepted)
+        return energy, offaxis, clipped
+
+    def sample_background(self, rng, n):
+        '''Energies (keV) of n background events'''
+        low, high = self.energy_range
+        energy = np.empty(n)
+        filled = 0
+        while filled < n:
+            m = int((n - filled) * 1.6) + 16
+            proposed = rng.uniform(low, high, m)
+            accepted = proposed[rng.uniform(0, self._background_max, m) < self.background(proposed)]
+            accepted = accepted[:n - filled]
+            energy[filled:filled + len(accepted)] = accepted
+            filled += len(accepted)
+        return energy
+
+    def _chunk(self, events, start, n_source, seed):
+        '''Fill the events of a chunk, numbered from start, of which those below
+        n_source are source events'''
+        rng = np.random.default_rng(seed)
+        n = len(events)
+        source = min(max(n_source - start, 0), n)
+        events['time'] = rng.uniform(0, self.exposure, n)
+        events['background'][:source] = False
+        events['background'][source:] = True
+        energy, offaxis, clipped = self.sample_source(rng, source)
+        events['energy'][:source] = energy
+        events['offaxis'][:source] = offaxis
+        events['energy'][source:] = self.sample_background(rng, n - source)
+        events['offaxis'][source:] = np.nan
+        return clipped
+
+    def simulate(self, filename=None, seed=None, processes=1, chunk_size=1000000):
+        """
+        Return a simulated event list, a structured array of event_dtype holding the
+        source events followed by the background events (not in time order).  Their
+        numbers are Poisson with means rate * exposure and background_rate * exposure.
+
+        With a filename the events are written to a memory-mapped .npy file, which is
+        returned, so memory stays bounded by chunk_size events whatever the number of
+        events.  Each chunk draws from its own random stream, spawned from seed, so the
+        result depends only on the seed and chunk_size, not on processes.  Chunks are
+        simulated on a multiprocessing pool of processes processes (None for one per
+        CPU) if that is not 1, which needs a filename and a picklable spectrum.
+        """
+        root = np.random.SeedSequence(seed)
+        rng = np.random.default_rng(root.spawn(1)[0])
+        n_source = rng.poisson(self.rate * self.exposure)
+        n_background = rng.poisson(self.background_rate * self.exposure)
+        total = n_source + n_background
+
+        if filename is None:
+            events = np.zeros(total, dtype=event_dtype)
+        else:
+            events = np.lib.format.open_memmap(filename, mode='w+', dtype=event_dtype, shape=(total,))
+
+        starts = range(0, total, chunk_size)
+        seeds = root.spawn(len(starts))
+        if processes == 1:
+            clipped = 0
+            for start, chunk_seed in zip(starts, seeds):
+                clipped += self._chunk(events[start:start + chunk_size], start, n_source, chunk_seed)
+        else:
+            if filename is None:
+                raise ValueError("Simulating on several processes needs a filename to write the events to")
+            events.flush()
+            import multiprocessing
+            pool = multiprocessing.Pool(processes, initializer=_set_simulator, initargs=(self,))
+            try:
+                tasks = [(filename, start, min(start + chunk_size, total), n_source, chunk_seed)
+                         for start, chunk_seed in zip(starts, seeds)]
+                clipped = sum(pool.map(_simulate_chunk, tasks, chunksize=1))
+            finally:
+                pool.close()
+                pool.join()
+        if clipped:
+            warnings.warn(str(clipped) + " proposals exceeded the sampling envelope, so the spectrum is "
+                          "slightly biased; use a smaller step_kev")
+        return events
+
+_simulator = None
+
+def _set_simulator(simulator):
+    global _simulator
+    _simulator = simulator
+
+def _simulate_chunk(task):
+    filename, start, stop, n_source, seed = task
+    events = np.load(filename, mmap_mode='r+')
+    clipped = _simulator._chunk(events[start:stop], start, n_source, seed)
+    events.flush()
+    return clipped
+
+def simulate_events(spectrum, exposure, filename=None, seed=None, processes=1, chunk_size=1000000,
+                    **kwargs):
+    '''Simulate an event list of a HEROES observation, see PhotonSimulator (for the
+    other arguments) and PhotonSimulator.simulate'''
+    simulator = PhotonSimulator(spectrum, exposure, **kwargs)
+    return simulator.simulate(filename=filename, seed=seed, processes=processes, chunk_size=chunk_size)
@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+
+__all__ = ["thermal_bremsstrahlung_grid", "thermal_bremsstrahlung_binned"]
+
+import numpy as np
+
+from .gaunt import mewe_gaunt_factor
+
+def _gaunt_grid(energy_kev, kt, gaunt):
+    if gaunt is None:
+        gaunt = mewe_gaunt_factor
+    return gaunt(energy_kev, kt, grid=True)
+
+def thermal_bremsstrahlung_grid(energy_kev, kt, emission_measure=None, gaunt=None):
+    """Optically thin thermal bremsstrahlung photon flux (photons s^-1 cm^-2 keV^-1)
+    at Earth for many temperatures at once.
+
+    energy_kev is an array of n_E energies, kt an array of n_T temperatures (keV) and
+    emission_measure (cm^-3) is either None, for the usual normalization of 1e49 cm^-3,
+    or broadcastable to n_T.  The result has shape (n_T, n_E) (kt.shape + energy_kev.shape
+    in general) and is computed with a single broadcasted gaunt factor evaluation.
+
+    gaunt is a function (energy_kev, kt, grid=True) -> array of shape kt.shape + energy_kev.shape.
+    The default is mewe_gaunt_factor (acgaunt), as in the IDL brem_49; itoh_gaunt_factor
+    or a GauntTable can be passed instead.
+    """
+    energy_kev = np.asarray(energy_kev, dtype='f8')
+    kt = np.asarray(kt, dtype='f8')
+    kt_grid = kt.reshape(kt.shape + (1,) * energy_kev.ndim)
+
+    result = (1.e8/9.26) * _gaunt_grid(energy_kev, kt, gaunt) * np.exp(-energy_kev / kt_grid) / (energy_kev * np.sqrt(kt_grid))
+
+    if emission_measure is not None:
+        emission_measure = np.asarray(emission_measure, dtype='f8')
+        result *= (emission_measure / 1e49).reshape(emission_measure.shape + (1,) * energy_kev.ndim)
+    return result
+
+def thermal_bremsstrahlung_binned(energy_edges_kev, kt, emission_measure=None, gaunt=None, order=4):
+    """Optically thin thermal bremsstrahlung photon flux (photons s^-1 cm^-2) integrated
+    over energy bins rather than sampled at the bin centres.
+
+    energy_edges_kev holds the n_E+1 bin edges; the result has shape (n_T, n_E).  Each bin
+    is integrated with an order-point Gauss-Legendre rule, all bins and temperatures
+    being evaluated in one call to thermal_bremsstrahlung_grid.  The default of 4 points
+    is accurate to better than 1e-4 for bins narrower than kT.  See
+    thermal_bremsstrahlung_grid for the other arguments.
+    """
+    edges = np.asarray(energy_edges_kev, dtype='f8')
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+
+    half_width = (edges[1:] - edges[:-1]) / 2
+    centre = (edges[1:] + edges[:-1]) / 2
+    energy_kev = centre[:,None] + half_width[:,None] * nodes[None,:]
+
+    flux = thermal_bremsstrahlung_grid(energy_kev.ravel(), kt, emission_measure=emission_measure, gaunt=gaunt)
+    flux = flux.reshape(flux.shape[:-1] + energy_kev.shape)
+    return np.dot(flux, weights) * half_width
@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+
+__all__ = ["telemetry_chunks", "ExposureAccumulator", "stream_exposure"]
+
+import numpy as np
+from scipy import interpolate
+
+from .datafiles import material_registry
+from .effective_area import heroes_effective_area_spline, _composite_rule
+
+def telemetry_chunks(source, chunk_size=3600):
+    """
+    Yield the telemetry of a flight in chunks of at most chunk_size samples.
+
+    source is a structured array (or a memory-mapped one), the name of a .npy file
+    holding one, which is memory-mapped so only a chunk at a time is read, or any
+    iterator of chunks, which are passed through unchanged.  The fields used by
+    ExposureAccumulator are altitude (km), elevation (degrees above the horizon),
+    offaxis (arcmin) and optionally exposure (s, one per sample if missing).
+    """
+    if isinstance(source, str):
+        source = np.load(source, mmap_mode='r')
+    if isinstance(source, np.ndarray):
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+    else:
+        for chunk in source:
+            yield chunk
+
+class ExposureAccumulator(object):
+    """
+    Running exposure-weighted average of effective area x atmospheric transmission
+    (cm^2) in energy bands, fed one telemetry chunk at a time with update().
+
+    For every sample the band average of A(e, offaxis) T(e, altitude, elevation) is
+    integrated over energy with order-point Gauss-Legendre panels between the knots
+    of the effective area spline and the energies tabulated for the material;
+    column_mass is a ColumnMassTable (see atmosphere_column_mass_table).  The energy
+    integral of the spline is folded into its off-axis B-spline coefficients once, so
+    each sample costs one exponential per energy node and one cubic B-spline
+    evaluation in off-axis angle.  Memory is bounded by the chunk size.
+
+    The totals are bit-identical whatever the chunking: samples are summed in blocks
+    of block_size samples at fixed positions in the flight, keeping the samples of an
+    unfinished block until it is complete, and the block sums are added in order.
+    """
+
+    def __init__(self, bands, column_mass, modules=None, material='air stp', order=4,
+                 block_size=4096):
+        self.bands = np.atleast_2d(np.asarray(bands, dtype='f8'))
+        self.column_mass = column_mass
+        self.block_size = block_size
+        mass_attenuation = material_registry.interpolator(material)
+
+        # A(e, r) = sum_ij c_ij B_i(e) B_j(r), with the spline clamped to its domain like .ev
+        f2d = heroes_effective_area_spline(modules)
+        tx, ty, c = f2d.tck
+        kx, ky = f2d.degrees
+        n_x, n_y = len(tx) - kx - 1, len(ty) - ky - 1
+        self._offaxis_basis = interpolate.BSpline(ty, np.eye(n_y), ky)
+        self._offaxis_range = (ty[0], ty[-1])
+        energy_basis = interpolate.BSpline(tx, np.eye(n_x), kx)
+
+        breaks = np.concatenate((tx, 10 ** material_registry.get(material)['log_energy_kev']))
+        self._rules = []
+        for low, high in self.bands:
+            energy, weights = _composite_rule(low, high, breaks, order)
+            mu = 10 ** mass_attenuation(np.log10(energy))
+            # off-axis coefficients of w_k A(e_k, r) for each energy node
+            coefficients = (weights[:,None] * energy_basis(np.clip(energy, tx[0], tx[-1]))).dot(c.reshape(n_x, n_y))
+            self._rules.append((mu, coefficients / (high - low)))
+
+        self.samples = 0
+        self._totals = np.zeros(len(self.bands) + 1)
+        self._pending = np.empty((0, len(self.bands) + 1))
+
+    def _sample_values(self, chunk):
+        '''Exposure and exposure x band averaged A T of each sample, column by column
+        so that the value of a sample does not depend on the rest of its chunk'''
+        altitude = np.asarray(chunk['altitude'], dtype='f8')
+        sin_elevation = np.sin(np.deg2rad(np.asarray(chunk['elevation'], dtype='f8')))
+        offaxis = np.asarray(chunk['offaxis'], dtype='f8')
+        names = chunk.dtype.names if hasattr(chunk, 'dtype') else chunk.keys()
+        if 'exposure' in names:
+            exposure = np.asarray(chunk['exposure'], dtype='f8')
+        else:
+            exposure = np.ones(len(altitude))
+
+        with np.errstate(divide='ignore'):
+            slant_column = np.where(sin_elevation > 0, self.column_mass(altitude) / sin_elevation, np.inf)
+
+        basis = self._offaxis_basis(np.clip(offaxis, *self._offaxis_range))
+
+        values = np.empty((len(altitude), len(self.bands) + 1))
+        values[:,0] = exposure
+        for i, (mu, coefficients) in enumerate(self._rules):
+            band_coefficients = np.zeros(basis.shape)
+            for m, coefficient in zip(mu, coefficients):
+                band_coefficients += np.exp(-slant_column * m)[:,None] * coefficient
+            band = np.zeros(len(altitude))
+            for j in range(basis.shape[1]):
+                band += band_coefficients[:,j] * basis[:,j]
+            values[:,i+1] = exposure * band
+        return values
+
+    def update(self, chunk):
+        '''Add a chunk of telemetry (see telemetry_chunks) and return self'''
+        values = self._sample_values(chunk)
+        self.samples += len(values)
+        values = np.concatenate((self._pending, values))
+        complete = len(values) // self.block_size * self.block_size
+        for start in range(0, complete, self.block_size):
+            self._totals += values[start:start + self.block_size].sum(axis=0)
+        self._pending = values[complete:]
+        return self
+
+    def _current(self):
+        return self._totals + self._pending.sum(axis=0)
+
+    @property
+    def exposure(self):
+        '''Total exposure (s)'''
+        return self._current()[0]
+
+    @property
+    def area_transmission(self):
+        '''Exposure-weighted average effective area x transmission (cm^2) per band'''
+        totals = self._current()
+        return totals[1:] / totals[0]
+
+def stream_exposure(source, bands, column_mass, chunk_size=3600, **kwargs):
+    """
+    Process the telemetry of a flight chunk by chunk (see telemetry_chunks for source)
+    and yield, after each chunk, the number of samples so far, their total exposure
+    (s) and the running exposure-weighted average of effective area x atmospheric
+    transmission (cm^2) in each of the energy bands.  Other keywords are passed to
+    ExposureAccumulator.
+    """
+    accumulator = ExposureAccumulator(bands, column_mass, **kwargs)
+    for chunk in telemetry_chunks(source, chunk_size):
+        accumulator.update(chunk)
+        yield accumulator.samples, accumulator.exposure, accumulator.area_transmission